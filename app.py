@@ -1,26 +1,88 @@
-﻿import os, datetime, jwt, smtplib, secrets, json, random, requests
+﻿import os, datetime, jwt, smtplib, secrets, json, requests
+import functools
+import operator
+import hashlib
+import hmac
+import threading
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote
+from collections import OrderedDict
 import csv
 import io
+import time
+import types
+import sqlite3
 try:
     import stripe
     STRIPE_AVAILABLE = True
 except ImportError:
     STRIPE_AVAILABLE = False
     stripe = None
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerificationError, InvalidHashError
+    ARGON2_AVAILABLE = True
+except ImportError:
+    ARGON2_AVAILABLE = False
+    PasswordHasher = None
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+    redis = None
+try:
+    from celery import Celery
+    CELERY_AVAILABLE = True
+except ImportError:
+    CELERY_AVAILABLE = False
+    Celery = None
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
 from email.message import EmailMessage
-from flask import Flask, jsonify, request, Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, jsonify, request, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from dotenv import load_dotenv
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask import g
-from sqlalchemy import text, inspect
+from flask import g, has_app_context
+from sqlalchemy import text, inspect, select, delete, update, and_, or_, event, func
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.dialects.postgresql import insert as pg_insert, JSONB
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import re
 
 load_dotenv()
+
+# App logger: records are queued and written to stderr by a background thread,
+# so request threads don't block formatting tracebacks during error bursts
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+logger = logging.getLogger("star4ce")
+logger.setLevel(logging.INFO)
+logger.addHandler(QueueHandler(_log_queue))
+logger.propagate = False
+
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret")
 
 # Stripe configuration
@@ -45,6 +107,26 @@ FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
 
 app = Flask(__name__)
 
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    jsonify / request.get_json backed by orjson. Datetimes and other
+    non-native types still go through Flask's default() so response
+    formats don't change.
+    """
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+if ORJSON_AVAILABLE:
+    app.json = ORJSONProvider(app)
+
 # CORS configuration - allow localhost in development, restrict in production
 frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
 is_production = os.getenv("ENVIRONMENT") == "production" or os.getenv("FLASK_ENV") == "production"
@@ -89,13 +171,71 @@ else:
          max_age=3600)
 
 # Rate limiting
+# With REDIS_URL set, limits are shared across workers; the moving-window
+# strategy runs as a single server-side Lua script per hit (sorted set).
+REDIS_URL = os.getenv("REDIS_URL")
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"  # Use Redis in production: os.getenv("REDIS_URL", "memory://")
+    storage_uri=REDIS_URL or "memory://",
+    storage_options={"max_connections": 50} if REDIS_URL else {},
+    strategy="moving-window",
+    key_prefix="rl",
+    # Keep limiting per process if Redis becomes unreachable
+    in_memory_fallback_enabled=bool(REDIS_URL),
 )
 
+# Shared Redis connection pool for app-level counters/caches (None without REDIS_URL)
+redis_client = redis.Redis.from_url(REDIS_URL, max_connections=50) if REDIS_AVAILABLE and REDIS_URL else None
+
+# Local short-circuit for clients that already hit a limit:
+# (endpoint, client address) -> (epoch seconds when the window resets, limit text).
+# Repeat requests during a flood are rejected here without a Redis round trip.
+# Bounded LRU, shared by request threads.
+RATE_LIMITED_CACHE_MAX = 10000
+_rate_limited_until = OrderedDict()
+_rate_limited_lock = threading.Lock()
+
+def rate_limit_response(description: str, retry_after: int):
+    """The one 429 body, for Flask-Limiter's own rejections and the short-circuit"""
+    response = jsonify(error="rate limit exceeded", message=description)
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+def _reject_known_rate_limited():
+    key = (request.endpoint, get_remote_address())
+    with _rate_limited_lock:
+        entry = _rate_limited_until.get(key)
+        if entry is None:
+            return None
+        until, description = entry
+        remaining = until - time.time()
+        if remaining <= 0:
+            del _rate_limited_until[key]
+            return None
+        _rate_limited_until.move_to_end(key)
+    return rate_limit_response(description, int(remaining) + 1)
+
+# Registered ahead of Flask-Limiter's own before_request hook so it actually short-circuits
+app.before_request_funcs.setdefault(None, []).insert(0, _reject_known_rate_limited)
+
+@app.errorhandler(429)
+def _rate_limited(e):
+    description = e.description if isinstance(e.description, str) else "too many requests"
+    retry_after = 60
+    current = limiter.current_limit
+    if current is not None and current.breached:
+        retry_after = max(1, int(current.reset_at - time.time()) + 1)
+        key = (request.endpoint, get_remote_address())
+        with _rate_limited_lock:
+            _rate_limited_until[key] = (current.reset_at, description)
+            _rate_limited_until.move_to_end(key)
+            while len(_rate_limited_until) > RATE_LIMITED_CACHE_MAX:
+                _rate_limited_until.popitem(last=False)
+    return rate_limit_response(description, retry_after)
+
 # --- DATABASE SETUP ---
 
 # Get DATABASE_URL from environment (PostgreSQL for production, SQLite for local dev)
@@ -120,10 +260,60 @@ if raw_db_url.startswith("postgres://"):
     raw_db_url = raw_db_url.replace("postgres://", "postgresql://", 1)
 
 app.config["SQLALCHEMY_DATABASE_URI"] = raw_db_url
+# "postgresql" or "sqlite", resolved once from the URL (drivers like +psycopg2 stripped)
+DB_DIALECT = make_url(raw_db_url).get_backend_name()
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+if DB_DIALECT == "postgresql":
+    # Larger pool for threaded workers and webhook bursts; pre-ping + recycle
+    # (under the ~300s idle timeout of hosted proxies like PgBouncer) survive
+    # dropped cloud connections, LIFO keeps the most recently used ones warm,
+    # and a short pool_timeout fails fast instead of queueing requests
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "40")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "10")),
+        "pool_pre_ping": True,
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "280")),
+        "pool_use_lifo": True,
+    }
+elif raw_db_url.startswith("sqlite:///"):
+    # Keep file connections pooled (and their WAL/shm mappings open) across
+    # requests instead of reopening the database; SQLite serializes writers
+    # itself, busy_timeout below makes them wait rather than fail.
+    # Never below 5 + overflow: startup migrations hold the session, inspect()
+    # and engine.begin() connections at the same time, even on a 1-CPU host
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "poolclass": QueuePool,
+        "pool_size": max(int(os.getenv("DB_POOL_SIZE", str(os.cpu_count() or 4))), 5),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "connect_args": {"check_same_thread": False},
+    }
+
 db = SQLAlchemy(app)
 
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",     # readers don't block the writer
+    "synchronous=NORMAL",   # safe with WAL, one fsync per checkpoint instead of per commit
+    "busy_timeout=5000",    # wait for the write lock instead of raising SQLITE_BUSY
+    "cache_size=-20000",    # ~20MB page cache
+    "temp_store=MEMORY",
+)
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _record):
+    """Tune every new SQLite connection (local dev / reset_db.py); no-op on PostgreSQL"""
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cur = dbapi_conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cur.execute(f"PRAGMA {pragma}")
+    cur.close()
+
+def iso_utc(value):
+    """Naive UTC datetime -> ISO 8601 string with a Z suffix (None stays None)"""
+    return value.isoformat() + "Z" if value else None
+
 class Dealership(db.Model):
     __tablename__ = "dealerships"
 
@@ -144,19 +334,15 @@ class Dealership(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
+    # Plain columns serialized as-is by to_dict (datetimes are formatted separately)
+    _COLUMNS = ("id", "name", "address", "city", "state", "zip_code", "subscription_status", "subscription_plan")
+    _get_columns = operator.attrgetter(*_COLUMNS)
+
     def to_dict(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "address": self.address,
-            "city": self.city,
-            "state": self.state,
-            "zip_code": self.zip_code,
-            "subscription_status": self.subscription_status,
-            "subscription_plan": self.subscription_plan,
-            "trial_ends_at": self.trial_ends_at.isoformat() + "Z" if self.trial_ends_at else None,
-            "subscription_ends_at": self.subscription_ends_at.isoformat() + "Z" if self.subscription_ends_at else None,
-        }
+        data = dict(zip(self._COLUMNS, self._get_columns(self)))
+        data["trial_ends_at"] = iso_utc(self.trial_ends_at)
+        data["subscription_ends_at"] = iso_utc(self.subscription_ends_at)
+        return data
 
     def is_subscription_active(self) -> bool:
         """Check if subscription is active (trial or paid)"""
@@ -228,15 +414,11 @@ class User(db.Model):
     # Timestamp for account creation (for cleanup of unsubscribed accounts)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
 
+    _COLUMNS = ("id", "email", "role", "is_verified", "dealership_id", "full_name")
+    _get_columns = operator.attrgetter(*_COLUMNS)
+
     def to_dict(self):
-        return {
-            "id": self.id,
-            "email": self.email,
-            "role": self.role,
-            "is_verified": self.is_verified,
-            "dealership_id": self.dealership_id,
-            "full_name": self.full_name,
-        }
+        return dict(zip(self._COLUMNS, self._get_columns(self)))
 
 
 class Employee(db.Model):
@@ -262,19 +444,20 @@ class Employee(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
+    # One employee per email within a dealership
+    __table_args__ = (
+        db.Index('ix_employees_dealership_email', 'dealership_id', 'email', unique=True),
+        db.Index('ix_employees_dealership_created', 'dealership_id', 'created_at', 'id'),
+    )
+
+    _COLUMNS = ("id", "name", "email", "phone", "department", "position", "dealership_id", "is_active")
+    _get_columns = operator.attrgetter(*_COLUMNS)
+
     def to_dict(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "email": self.email,
-            "phone": self.phone,
-            "department": self.department,
-            "position": self.position,
-            "dealership_id": self.dealership_id,
-            "is_active": self.is_active,
-            "created_at": self.created_at.isoformat() + "Z",
-            "updated_at": self.updated_at.isoformat() + "Z",
-        }
+        data = dict(zip(self._COLUMNS, self._get_columns(self)))
+        data["created_at"] = iso_utc(self.created_at)
+        data["updated_at"] = iso_utc(self.updated_at)
+        return data
 
 
 class SurveyAccessCode(db.Model):
@@ -290,6 +473,14 @@ class SurveyAccessCode(db.Model):
     expires_at = db.Column(db.DateTime, nullable=True)
     is_active = db.Column(db.Boolean, nullable=False, default=True)
 
+    __table_args__ = (
+        db.Index('ix_sac_dealer_code', 'dealership_id', 'code'),
+        db.Index('ix_sac_dealer_created', 'dealership_id', db.text('created_at DESC')),
+        # Most lookups only care about codes that can still be used
+        db.Index('ix_sac_active_dealer', 'dealership_id',
+                 postgresql_where=db.text('is_active'), sqlite_where=db.text('is_active')),
+    )
+
 
 class SurveyAnswer(db.Model):
     __tablename__ = "survey_answers"
@@ -302,11 +493,13 @@ class SurveyAnswer(db.Model):
     access_code_id = db.Column(db.Integer, db.ForeignKey("survey_access_codes.id"), nullable=True)
     access_code = db.relationship("SurveyAccessCode", backref="answers")
 
-    # Store survey responses as a JSON string (we’ll parse in Python)
-    payload = db.Column(db.Text, nullable=False)
+    # Survey responses as JSON (JSONB on PostgreSQL); SQLAlchemy handles encoding
+    payload = db.Column(db.JSON().with_variant(JSONB(), "postgresql"), nullable=False)
 
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
 
+    __table_args__ = (db.Index('ix_sa_dealer_created', 'dealership_id', 'created_at'),)
+
 
 
 class SurveyResponse(db.Model):
@@ -333,16 +526,28 @@ class SurveyResponse(db.Model):
 
     additional_feedback = db.Column(db.Text, nullable=True)
 
+    # Scored answer totals, filled in on submit so analytics can SUM them
+    # without decoding the JSON columns (see score_answers)
+    satisfaction_sum = db.Column(db.Integer, nullable=False, default=0)
+    satisfaction_count = db.Column(db.Integer, nullable=False, default=0)
+    training_sum = db.Column(db.Integer, nullable=False, default=0)
+    training_count = db.Column(db.Integer, nullable=False, default=0)
+
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_sr_access_created', 'access_code', 'created_at'),
+        db.Index('ix_sr_created', 'created_at'),
+        db.Index('ix_sr_status_role', 'employee_status', 'role'),
+    )
+
+    _COLUMNS = ("id", "access_code", "employee_status", "role")
+    _get_columns = operator.attrgetter(*_COLUMNS)
+
     def to_dict(self):
-        return {
-            "id": self.id,
-            "access_code": self.access_code,
-            "employee_status": self.employee_status,
-            "role": self.role,
-            "created_at": self.created_at.isoformat() + "Z",
-        }
+        data = dict(zip(self._COLUMNS, self._get_columns(self)))
+        data["created_at"] = iso_utc(self.created_at)
+        return data
 
 class AdminRequest(db.Model):
     __tablename__ = "admin_requests"
@@ -367,8 +572,8 @@ class AdminRequest(db.Model):
             "dealership_id": self.dealership_id,
             "dealership_name": self.dealership.name if self.dealership else None,
             "status": self.status,
-            "requested_at": self.requested_at.isoformat() + "Z",
-            "reviewed_at": self.reviewed_at.isoformat() + "Z" if self.reviewed_at else None,
+            "requested_at": iso_utc(self.requested_at),
+            "reviewed_at": iso_utc(self.reviewed_at),
             "reviewed_by": self.reviewed_by,
             "notes": self.notes,
         }
@@ -400,8 +605,8 @@ class DealershipAccessRequest(db.Model):
             "dealership_id": self.dealership_id,
             "dealership_name": self.dealership.name if self.dealership else None,
             "status": self.status,
-            "requested_at": self.requested_at.isoformat() + "Z",
-            "reviewed_at": self.reviewed_at.isoformat() + "Z" if self.reviewed_at else None,
+            "requested_at": iso_utc(self.requested_at),
+            "reviewed_at": iso_utc(self.reviewed_at),
             "reviewed_by": self.reviewed_by,
             "reviewer_email": self.reviewer.email if self.reviewer else None,
             "notes": self.notes,
@@ -434,8 +639,8 @@ class ManagerDealershipRequest(db.Model):
             "dealership_id": self.dealership_id,
             "dealership_name": self.dealership.name if self.dealership else None,
             "status": self.status,
-            "requested_at": self.requested_at.isoformat() + "Z",
-            "reviewed_at": self.reviewed_at.isoformat() + "Z" if self.reviewed_at else None,
+            "requested_at": iso_utc(self.requested_at),
+            "reviewed_at": iso_utc(self.reviewed_at),
             "reviewed_by": self.reviewed_by,
             "reviewer_email": self.reviewer.email if self.reviewer else None,
             "notes": self.notes,
@@ -514,9 +719,32 @@ class AdminAuditLog(db.Model):
             "resource_id": self.resource_id,
             "details": self.details,
             "ip_address": self.ip_address,
-            "created_at": self.created_at.isoformat() + "Z",
+            "created_at": iso_utc(self.created_at),
         }
 
+class SchemaMigration(db.Model):
+    """One row per startup migration that has been applied"""
+    __tablename__ = "schema_migrations"
+
+    name = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+class WebhookEvent(db.Model):
+    """Raw webhook deliveries, stored on receipt and processed in the background"""
+    __tablename__ = "webhook_events"
+
+    id = db.Column(db.Integer, primary_key=True)
+    external_id = db.Column(db.String(255), unique=True, nullable=False)  # e.g. Stripe event id
+    provider = db.Column(db.String(50), nullable=False, default="stripe")
+    type = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON().with_variant(JSONB(), "postgresql"), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, processing, processed, failed
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    claimed_at = db.Column(db.DateTime, nullable=True)  # when a worker last set status=processing
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at = db.Column(db.DateTime, nullable=True)  # retry backoff for pending rows
+    processed_at = db.Column(db.DateTime, nullable=True)
+
 @app.get("/health")
 def health():
     """Health check endpoint with system status"""
@@ -542,38 +770,238 @@ def health():
         environment=os.getenv("ENVIRONMENT", "development")
     )
 
+def generate_six_digit_code() -> str:
+    """Uniform 6-digit verification code (one 20-bit draw, ~5% chance of a redraw)"""
+    return f"{secrets.randbelow(1_000_000):06d}"
+
 def make_token(email: str, role: str = "manager"):
     """Create JWT token with reasonable expiration for better UX"""
+    now = datetime.datetime.utcnow()
     payload = {
         "sub": email,
         "role": role,
-        "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=24),  # 24 hours for better UX
-        "iat": datetime.datetime.utcnow(),
+        "exp": now + datetime.timedelta(hours=24),  # 24 hours for better UX
+        "iat": now,
     }
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
+# Decoded JWT claims, keyed by a truncated sha256 of the token:
+# key -> (claims or error message, evict_at epoch seconds).
+# Entries live at most JWT_CACHE_TTL seconds (and never past the token's exp),
+# so an expired token is re-checked by jwt.decode almost immediately.
+JWT_CACHE_TTL = 30
+JWT_NEGATIVE_CACHE_TTL = 5
+JWT_CACHE_MAX = 10000
+_jwt_cache = {}
+_jwt_cache_lock = threading.Lock()
+
+def _jwt_cache_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()[:16]
+
+def _jwt_cache_put(key: bytes, value, evict_at: float):
+    with _jwt_cache_lock:
+        if len(_jwt_cache) >= JWT_CACHE_MAX:
+            # Drop the oldest entry (dicts keep insertion order)
+            _jwt_cache.pop(next(iter(_jwt_cache)), None)
+        _jwt_cache[key] = (value, evict_at)
+
 def verify_token(token: str):
     """Verify JWT token, handling expiration gracefully"""
+    key = _jwt_cache_key(token)
+    now = time.time()
+    cached = _jwt_cache.get(key)
+    if cached is not None and cached[1] > now:
+        if isinstance(cached[0], str):
+            raise ValueError(cached[0])
+        return cached[0]
+
     try:
-        return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        claims = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
     except jwt.ExpiredSignatureError:
         raise ValueError("Token expired")
     except jwt.InvalidTokenError:
+        # Short negative cache so replayed garbage tokens skip the HMAC check
+        _jwt_cache_put(key, "Invalid token", now + JWT_NEGATIVE_CACHE_TTL)
         raise ValueError("Invalid token")
 
-def get_current_user():
+    _jwt_cache_put(key, claims, min(claims.get("exp", now), now + JWT_CACHE_TTL))
+    return claims
+
+# New hashes use argon2id when argon2-cffi is installed; existing Werkzeug
+# (pbkdf2/scrypt) hashes keep verifying and are upgraded on the next login.
+# Costs are tunable per deploy; changing them rehashes users on their next login.
+_argon2 = PasswordHasher(
+    time_cost=int(os.getenv("ARGON2_TIME_COST", "2")),
+    memory_cost=int(os.getenv("ARGON2_MEMORY_KIB", str(64 * 1024))),
+    parallelism=int(os.getenv("ARGON2_PARALLELISM", "1")),
+) if ARGON2_AVAILABLE else None
+
+# Recent successful password checks: hmac(email, hash, password) -> expires_at.
+# Only successes are cached, so failed guesses never skip the hash.
+PASSWORD_CHECK_CACHE_TTL = 30
+_pw_check_cache = {}
+
+def hash_password(password: str) -> str:
+    """Hash a password with argon2id, or Werkzeug's default if argon2 is missing"""
+    if _argon2 is not None:
+        return _argon2.hash(password)
+    return generate_password_hash(password)
+
+def password_needs_rehash(password_hash: str) -> bool:
+    """True if the stored hash should be replaced with a fresh hash_password()"""
+    if _argon2 is None:
+        return False
+    if not password_hash.startswith("$argon2"):
+        return True
+    return _argon2.check_needs_rehash(password_hash)
+
+def verify_password(email: str, password_hash: str, password: str) -> bool:
+    """Check a password against its stored hash (argon2 or Werkzeug format)"""
+    key = hmac.new(JWT_SECRET.encode(), f"{email}\0{password_hash}\0{password}".encode(), "sha256").digest()
+    now = time.monotonic()
+    expires = _pw_check_cache.get(key)
+    if expires is not None and expires > now:
+        return True
+
+    if password_hash.startswith("$argon2"):
+        if _argon2 is None:
+            return False
+        try:
+            ok = _argon2.verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            ok = False
+    else:
+        ok = check_password_hash(password_hash, password)
+
+    if ok:
+        if len(_pw_check_cache) >= 2000:
+            _pw_check_cache.clear()
+        _pw_check_cache[key] = now + PASSWORD_CHECK_CACHE_TTL
+    return ok
+
+# Auth fields per user, keyed by email. Only what the auth checks need is cached
+# (never password hashes or one-time codes), for USER_CACHE_TTL seconds in Redis
+# (shared by workers, so an approve/delete in one worker is seen by all) or
+# in-process. Committed User writes drop the entry, and endpoints that change
+# auth state also drop it explicitly.
+USER_CACHE_TTL = 60
+USER_CACHE_MAX = 5000
+USER_CACHE_FIELDS = ("id", "role", "is_verified", "is_approved", "dealership_id")
+_user_cache = {}  # email -> (fields, expires_at); used without Redis
+_user_cache_lock = threading.Lock()
+
+class AuthUser:
     """
-    Reads the Bearer token from Authorization header,
-    verifies it, and returns the User object.
-    Returns (user, error_response) so callers can handle 401/403 cleanly.
+    A cached user for the auth path: the USER_CACHE_FIELDS plus email, with the
+    full User row loaded on first access to anything else (or on any write).
     """
-    auth = request.headers.get("Authorization", "") or request.headers.get("authorization", "")
-    if not auth.startswith("Bearer "):
-        return None, (jsonify(error="missing bearer token"), 401)
 
-    token = auth.split(" ", 1)[1].strip()
+    def __init__(self, email: str, fields: dict):
+        object.__setattr__(self, "_fields", dict(fields, email=email))
+        object.__setattr__(self, "_user", None)
+
+    def _load(self):
+        if self._user is None:
+            user = db.session.get(User, self._fields["id"])
+            if user is None:
+                raise LookupError(f"user {self._fields['email']} no longer exists")
+            object.__setattr__(self, "_user", user)
+        return self._user
+
+    def __getattr__(self, name):
+        if self._user is None and name in self._fields:
+            return self._fields[name]
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+def _cached_user_fields(email: str):
+    if redis_client is not None:
+        try:
+            raw = redis_client.get(f"user_auth:{email}")
+            return json.loads(raw) if raw is not None else None
+        except redis.RedisError as e:
+            print(f"[USER CACHE] Redis read failed: {e}", flush=True)
+            return None
+    entry = _user_cache.get(email)
+    if entry is not None and entry[1] > time.monotonic():
+        return entry[0]
+    return None
+
+def _cache_user_fields(user):
+    fields = {name: getattr(user, name) for name in USER_CACHE_FIELDS}
+    if redis_client is not None:
+        try:
+            redis_client.setex(f"user_auth:{user.email}", USER_CACHE_TTL, json.dumps(fields))
+        except redis.RedisError as e:
+            print(f"[USER CACHE] Redis write failed: {e}", flush=True)
+        return
+    with _user_cache_lock:
+        if len(_user_cache) >= USER_CACHE_MAX:
+            _user_cache.pop(next(iter(_user_cache)), None)
+        _user_cache[user.email] = (fields, time.monotonic() + USER_CACHE_TTL)
+
+def invalidate_user_cache(emails):
+    """Drop cached auth fields after User writes"""
+    emails = [email for email in emails if email]
+    if not emails:
+        return
+    for email in emails:
+        _user_cache.pop(email, None)
+    if redis_client is not None:
+        try:
+            redis_client.delete(*(f"user_auth:{email}" for email in emails))
+        except redis.RedisError as e:
+            print(f"[USER CACHE] Redis delete failed: {e}", flush=True)
+
+def load_user_by_email(email: str):
+    """User lookup for the auth path: an AuthUser from the cache when fresh, else the User row"""
+    fields = _cached_user_fields(email)
+    if fields is not None:
+        return AuthUser(email, fields)
+
+    user = User.query.options(joinedload(User.dealership)).filter_by(email=email).first()
+    if user is not None:
+        _cache_user_fields(user)
+    return user
+
+@event.listens_for(Session, "after_flush")
+def _track_flushed_users(session, flush_context):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            session.info.setdefault("_dirty_users", set()).add(obj.email)
+
+@event.listens_for(Session, "after_commit")
+def _drop_committed_users(session):
+    invalidate_user_cache(session.info.pop("_dirty_users", ()))
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_users(session):
+    session.info.pop("_dirty_users", None)
+
+def extract_bearer_token():
+    """
+    Returns (token, None) from the Authorization header, or (None, error_response).
+    Werkzeug headers are case-insensitive, so one lookup covers "authorization" too.
+    """
+    auth = request.headers.get("Authorization", "")
+    if auth[:7] != "Bearer ":
+        return None, (jsonify(error="missing bearer token"), 401)
+    token = auth[7:].strip()
     if not token:
         return None, (jsonify(error="empty token"), 401)
+    return token, None
+
+def authenticate_request():
+    """
+    Bearer token -> User, with no role/verification checks.
+    Shared by get_current_user and /auth/me so a token is only decoded once
+    per request. Returns (user, error_response).
+    """
+    token, err = extract_bearer_token()
+    if err:
+        return None, err
     
     try:
         claims = verify_token(token)
@@ -584,21 +1012,32 @@ def get_current_user():
             return None, (jsonify(error="token expired"), 401)
         return None, (jsonify(error="invalid token"), 401)
     except Exception as e:
-        print(f"[AUTH ERROR] get_current_user failed: {e}", flush=True)
+        print(f"[AUTH ERROR] token verification failed: {e}", flush=True)
         return None, (jsonify(error="invalid token"), 401)
 
     email = claims.get("sub")
     if not email:
         return None, (jsonify(error="invalid token payload"), 401)
 
-    user = User.query.filter_by(email=email).first()
+    user = load_user_by_email(email)
     if not user:
         return None, (jsonify(error="user not found"), 401)
+    return user, None
+
+def get_current_user():
+    """
+    Reads the Bearer token from Authorization header,
+    verifies it, and returns the User object.
+    Returns (user, error_response) so callers can handle 401/403 cleanly.
+    """
+    user, err = authenticate_request()
+    if err:
+        return None, err
 
     # Auto-upgrade users with active subscriptions to admin
     # This handles cases where webhook didn't fire or user subscribed before webhook was set up
     if user.role == "manager" and user.dealership_id:
-        dealership = Dealership.query.get(user.dealership_id)
+        dealership = user.dealership  # joined-loaded with the user
         if dealership and dealership.is_subscription_active():
             # User has active subscription but is still manager - upgrade to admin
             user.role = "admin"
@@ -659,13 +1098,123 @@ def get_accessible_dealership_ids(user) -> list[int]:
             return [user.dealership_id]
         return []
     elif user.role == "corporate":
-        # Get all dealership IDs from the many-to-many relationship
-        return [d.id for d in user.corporate_dealerships.all()]
+        # Memoized per request: several handlers check access more than once
+        cache = getattr(g, "_dealership_ids", None)
+        if cache is None:
+            cache = g._dealership_ids = {}
+        if user.id not in cache:
+            # Get all dealership IDs from the many-to-many relationship
+            cache[user.id] = [d.id for d in user.corporate_dealerships.all()]
+        return cache[user.id]
     return []
 
-def log_admin_action(admin_email: str, action: str, resource_type: str, resource_id: int = None, details: str = None):
-    """Log admin actions for audit trail"""
+# Subscription state per dealership: dealership_id -> (subscription_status, trial end epoch).
+# Checked on every gated admin endpoint, so it is memoized on flask.g for the
+# request and cached for SUBSCRIPTION_CACHE_TTL seconds in Redis (shared by
+# workers) or in-process. Committed writes to a Dealership drop the entry.
+SUBSCRIPTION_CACHE_TTL = 60
+_subscription_cache = {}  # dealership_id -> (state, expires_at); used without Redis
+
+def _load_subscription_state(dealership_id: int):
+    row = db.session.query(Dealership.subscription_status, Dealership.trial_ends_at).filter_by(id=dealership_id).first()
+    if row is None:
+        return None
+    trial_ends = row.trial_ends_at.replace(tzinfo=datetime.timezone.utc).timestamp() if row.trial_ends_at else None
+    return (row.subscription_status, trial_ends)
+
+def _subscription_state(dealership_id: int):
+    memo = getattr(g, "_subscription_states", None)
+    if memo is None:
+        memo = g._subscription_states = {}
+    if dealership_id in memo:
+        return memo[dealership_id]
+
+    state = None
+    cached = False
+    if redis_client is not None:
+        try:
+            raw = redis_client.get(f"sub:{dealership_id}")
+            if raw is not None:
+                state = json.loads(raw)
+                state = tuple(state) if state else None
+                cached = True
+        except redis.RedisError as e:
+            print(f"[SUBSCRIPTION CACHE] Redis read failed: {e}", flush=True)
+    else:
+        entry = _subscription_cache.get(dealership_id)
+        if entry is not None and entry[1] > time.monotonic():
+            state, cached = entry[0], True
+
+    if not cached:
+        state = _load_subscription_state(dealership_id)
+        if redis_client is not None:
+            try:
+                redis_client.setex(f"sub:{dealership_id}", SUBSCRIPTION_CACHE_TTL, json.dumps(state))
+            except redis.RedisError as e:
+                print(f"[SUBSCRIPTION CACHE] Redis write failed: {e}", flush=True)
+        else:
+            _subscription_cache[dealership_id] = (state, time.monotonic() + SUBSCRIPTION_CACHE_TTL)
+
+    memo[dealership_id] = state
+    return state
+
+def subscription_active(dealership_id: int):
+    """
+    Same rule as Dealership.is_subscription_active, from the cache.
+    Returns None if the dealership doesn't exist.
+    """
+    state = _subscription_state(dealership_id)
+    if state is None:
+        return None
+    status, trial_ends = state
+    if status == "trial":
+        return bool(trial_ends and trial_ends > time.time())
+    return status == "active"
+
+def trial_days_remaining(state) -> int:
+    """Dealership.days_remaining_in_trial for a cached subscription state"""
+    status, trial_ends = state
+    if status == "trial" and trial_ends:
+        return max(0, int((trial_ends - time.time()) // 86400))
+    return 0
+
+def invalidate_subscription_cache(dealership_ids):
+    """Drop cached subscription state after dealership writes"""
+    dealership_ids = list(dealership_ids)
+    if not dealership_ids:
+        return
+    for dealership_id in dealership_ids:
+        _subscription_cache.pop(dealership_id, None)
+    if has_app_context():
+        memo = getattr(g, "_subscription_states", None)
+        if memo:
+            for dealership_id in dealership_ids:
+                memo.pop(dealership_id, None)
+    if redis_client is not None:
+        try:
+            redis_client.delete(*(f"sub:{dealership_id}" for dealership_id in dealership_ids))
+        except redis.RedisError as e:
+            print(f"[SUBSCRIPTION CACHE] Redis delete failed: {e}", flush=True)
+
+@event.listens_for(Session, "after_flush")
+def _track_flushed_dealerships(session, flush_context):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Dealership) and obj.id is not None:
+            session.info.setdefault("_dirty_dealerships", set()).add(obj.id)
+
+@event.listens_for(Session, "after_commit")
+def _drop_committed_dealerships(session):
+    invalidate_subscription_cache(session.info.pop("_dirty_dealerships", ()))
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_dealerships(session):
+    session.info.pop("_dirty_dealerships", None)
+
+def log_admin_action(admin_email: str, action: str, resource_type: str, resource_id: int = None, details=None):
+    """Log admin actions for audit trail (details may be a dict; it's stored as JSON text)"""
     try:
+        if details is not None and not isinstance(details, str):
+            details = json_text(details)
         ip_address = request.remote_addr if request else None
         # Log to console for debugging
         print(f"[AUDIT] {admin_email} - {action} - {resource_type} - {resource_id} - IP: {ip_address}", flush=True)
@@ -686,6 +1235,71 @@ def log_admin_action(admin_email: str, action: str, resource_type: str, resource
         print(f"[AUDIT ERROR] Failed to log action: {e}", flush=True)
         db.session.rollback()
 
+# Keep-alive HTTP session for the Resend API so repeat sends reuse the TLS
+# connection. Retry only covers connection failures and 502/503/504 on
+# idempotent methods; the POST itself is never replayed.
+resend_session = requests.Session()
+resend_session.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+))
+resend_session.headers.update({
+    "Authorization": f"Bearer {RESEND_API_KEY}",
+    "Content-Type": "application/json",
+})
+
+class SMTPPool:
+    """
+    Keeps one authenticated SMTP connection per thread so consecutive emails
+    skip the connect + STARTTLS + AUTH handshake. Idle connections are checked
+    with NOOP before reuse, and a dropped connection is reopened once.
+    """
+    IDLE_PING_SECONDS = 60
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _connect(self):
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+        server.starttls()
+        server.login(SMTP_USER, SMTP_PASSWORD)
+        self._local.server = server
+        return server
+
+    def _drop(self):
+        server = getattr(self._local, "server", None)
+        self._local.server = None
+        if server is not None:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _get(self):
+        server = getattr(self._local, "server", None)
+        if server is None:
+            return self._connect()
+        if time.monotonic() - getattr(self._local, "last_used", 0) > self.IDLE_PING_SECONDS:
+            try:
+                if server.noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected("noop failed")
+            except (smtplib.SMTPException, OSError):
+                self._drop()
+                return self._connect()
+        return server
+
+    def send(self, msg: EmailMessage):
+        try:
+            self._get().send_message(msg)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException):
+            # Stale connection: reconnect and retry once
+            self._drop()
+            self._connect().send_message(msg)
+        self._local.last_used = time.monotonic()
+
+smtp_pool = SMTPPool()
+
 def send_email_via_resend_or_smtp(to_email: str, subject: str, body: str):
     """
     Unified email sending function.
@@ -698,12 +1312,8 @@ def send_email_via_resend_or_smtp(to_email: str, subject: str, body: str):
     # ---- Preferred: Resend HTTP API (production) ----
     if RESEND_API_KEY and EMAIL_FROM:
         try:
-            resp = requests.post(
+            resp = resend_session.post(
                 "https://api.resend.com/emails",
-                headers={
-                    "Authorization": f"Bearer {RESEND_API_KEY}",
-                    "Content-Type": "application/json",
-                },
                 json={
                     "from": EMAIL_FROM,
                     "to": [to_email],
@@ -741,10 +1351,7 @@ def send_email_via_resend_or_smtp(to_email: str, subject: str, body: str):
         msg["To"] = to_email
         msg.set_content(body)
 
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASSWORD)
-            server.send_message(msg)
+        smtp_pool.send(msg)
 
         print(f"[EMAIL] ✓ Sent via SMTP to {to_email}", flush=True)
         return True
@@ -755,6 +1362,168 @@ def send_email_via_resend_or_smtp(to_email: str, subject: str, body: str):
         )
         return False
 
+# Transactional emails are sent off the request thread so handlers like
+# /auth/login and /auth/register don't wait on Resend/SMTP round trips.
+# With CELERY_BROKER_URL set (and celery installed) they go to a Celery worker
+# (`celery -A app.celery worker`) with retries; otherwise to a local thread pool.
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
+celery = Celery(__name__, broker=CELERY_BROKER_URL) if CELERY_AVAILABLE and CELERY_BROKER_URL else None
+_email_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="email")
+
+class EmailSendError(Exception):
+    """Raised inside the Celery task so a failed send is retried"""
+
+if celery is not None:
+    @celery.task(name="star4ce.send_email", autoretry_for=(EmailSendError, smtplib.SMTPException),
+                 retry_backoff=True, max_retries=5)
+    def send_email_task(to_email: str, subject: str, body: str):
+        if not send_email_via_resend_or_smtp(to_email, subject, body):
+            raise EmailSendError(f"email to {to_email} not sent")
+
+def queue_email(to_email: str, subject: str, body: str):
+    """Send an email in the background (failures are logged by the sender)"""
+    if celery is not None:
+        return send_email_task.delay(to_email, subject, body)
+    return _email_pool.submit(send_email_via_resend_or_smtp, to_email, subject, body)
+
+# Verification email quota per user: one per 5 minutes and at most 5 per day.
+# Counters live in Redis when configured (shared by all workers), else in-process.
+VERIFY_EMAIL_COOLDOWN_SECONDS = 300
+VERIFY_EMAIL_DAILY_MAX = 5
+LOCAL_EMAIL_QUOTA_MAX = 10000
+_local_email_quota = {}  # key -> [count, expires_at]
+_local_email_quota_lock = threading.Lock()
+
+def _local_quota_hit(key: str, ttl: int):
+    now = time.time()
+    with _local_email_quota_lock:
+        entry = _local_email_quota.get(key)
+        if entry is None and len(_local_email_quota) >= LOCAL_EMAIL_QUOTA_MAX:
+            # Full: sweep expired windows, then drop the oldest keys if still needed
+            for stale in [k for k, (_, expires_at) in _local_email_quota.items() if expires_at <= now]:
+                del _local_email_quota[stale]
+            while len(_local_email_quota) >= LOCAL_EMAIL_QUOTA_MAX:
+                _local_email_quota.pop(next(iter(_local_email_quota)))
+        if entry is None or entry[1] <= now:
+            entry = _local_email_quota[key] = [0, now + ttl]
+        entry[0] += 1
+        return entry[0], int(entry[1] - now) + 1
+
+VERIFY_CODE_TTL_SECONDS = 3600
+RESET_CODE_TTL_SECONDS = 600
+
+# Quota check and code storage in one round trip.
+# KEYS: period counter, daily counter, code key
+# ARGV: period ttl, daily ttl, daily max, code, code ttl
+# Returns 0 once the code is stored, else seconds until another email is allowed.
+_ISSUE_CODE_LUA = """
+local period = redis.call('INCR', KEYS[1])
+if period == 1 then redis.call('EXPIRE', KEYS[1], ARGV[1]) end
+local daily = redis.call('INCR', KEYS[2])
+if daily == 1 then redis.call('EXPIRE', KEYS[2], ARGV[2]) end
+if daily > tonumber(ARGV[3]) then return math.max(redis.call('TTL', KEYS[2]), 1) end
+if period > 1 then return math.max(redis.call('TTL', KEYS[1]), 1) end
+redis.call('SET', KEYS[3], ARGV[4], 'EX', ARGV[5])
+return 0
+"""
+_issue_code_script = redis_client.register_script(_ISSUE_CODE_LUA) if redis_client is not None else None
+
+def issue_verification_code(user):
+    """
+    Count one verification email for this user and, if the quota allows, give
+    them a fresh code. Returns (code, 0) when the email should be sent, else
+    (None, seconds until the next one is allowed).
+    With Redis the code is stored there with a TTL (no DB write); otherwise it
+    goes on the User row and the caller commits.
+    """
+    period_key = f"email_verif_period:{user.id}"
+    daily_key = f"email_verif_daily:{user.id}"
+    code = generate_six_digit_code()
+    if _issue_code_script is not None:
+        try:
+            retry_after = _issue_code_script(
+                keys=[period_key, daily_key, f"verify_code:{user.id}"],
+                args=[VERIFY_EMAIL_COOLDOWN_SECONDS, 86400, VERIFY_EMAIL_DAILY_MAX, code, VERIFY_CODE_TTL_SECONDS],
+            )
+            return (code, 0) if retry_after == 0 else (None, int(retry_after))
+        except redis.RedisError as e:
+            print(f"[RATE LIMIT] Redis unavailable, not limiting verification email: {e}", flush=True)
+    else:
+        period_count, period_ttl = _local_quota_hit(period_key, VERIFY_EMAIL_COOLDOWN_SECONDS)
+        daily_count, daily_ttl = _local_quota_hit(daily_key, 86400)
+        if daily_count > VERIFY_EMAIL_DAILY_MAX:
+            return None, max(daily_ttl, 1)
+        if period_count > 1:
+            return None, max(period_ttl, 1)
+
+    _store_code_on_row(user, "verify_code", code, VERIFY_CODE_TTL_SECONDS)
+    return code, 0
+
+# One-time codes live in Redis ("{kind}:{user_id}", with a TTL) when it's
+# configured, else in these User columns: kind -> (code column, expiry column)
+_ONE_TIME_CODE_COLUMNS = {
+    "verify_code": ("verification_code", "verification_expires_at"),
+    "reset_code": ("reset_code", "reset_code_expires_at"),
+}
+
+def _store_code_on_row(user, kind: str, code: str, ttl: int):
+    code_column, expires_column = _ONE_TIME_CODE_COLUMNS[kind]
+    setattr(user, code_column, code)
+    setattr(user, expires_column, datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl))
+
+def store_one_time_code(user, kind: str, code: str, ttl: int):
+    """Save a code for this user; only the DB fallback needs the caller to commit"""
+    if redis_client is not None:
+        try:
+            redis_client.set(f"{kind}:{user.id}", code, ex=ttl)
+            return
+        except redis.RedisError as e:
+            print(f"[CODES] Redis unavailable, storing {kind} in the DB: {e}", flush=True)
+    _store_code_on_row(user, kind, code, ttl)
+
+def one_time_code_status(user, kind: str, code: str) -> str:
+    """'ok', 'invalid' or 'expired' for a code typed by the user"""
+    if redis_client is not None:
+        try:
+            stored = redis_client.get(f"{kind}:{user.id}")
+        except redis.RedisError as e:
+            print(f"[CODES] Redis unavailable, checking the DB {kind}: {e}", flush=True)
+            stored = None
+        if stored is not None:
+            return "ok" if hmac.compare_digest(stored, code.encode()) else "invalid"
+
+    code_column, expires_column = _ONE_TIME_CODE_COLUMNS[kind]
+    stored = getattr(user, code_column)
+    # Constant-time compare so response timing doesn't leak matching digits
+    if not stored or not hmac.compare_digest(stored.encode(), code.encode()):
+        return "invalid"
+    expires_at = getattr(user, expires_column)
+    if expires_at and expires_at < datetime.datetime.utcnow():
+        return "expired"
+    return "ok"
+
+def clear_one_time_code(user, kind: str):
+    """Forget a used code (the caller commits the column reset)"""
+    if redis_client is not None:
+        try:
+            redis_client.delete(f"{kind}:{user.id}")
+        except redis.RedisError as e:
+            print(f"[CODES] Could not delete {kind} from Redis: {e}", flush=True)
+    code_column, expires_column = _ONE_TIME_CODE_COLUMNS[kind]
+    setattr(user, code_column, None)
+    setattr(user, expires_column, None)
+
+def reset_verification_email_quota(user_id: int):
+    """Clear the quota once the user has verified"""
+    keys = (f"email_verif_period:{user_id}", f"email_verif_daily:{user_id}")
+    if redis_client is not None:
+        try:
+            redis_client.delete(*keys)
+        except redis.RedisError as e:
+            print(f"[RATE LIMIT] Could not reset verification email quota: {e}", flush=True)
+    for key in keys:
+        _local_email_quota.pop(key, None)
+
 def send_verification_email(to_email: str, code: str):
     """
     Sends a verification email with a 6-digit code.
@@ -783,7 +1552,7 @@ This code expires in 1 hour.
     if os.getenv("ENVIRONMENT") != "production":
         print(f"[EMAIL DEBUG] Verification code for {to_email}: {code}", flush=True)
     
-    send_email_via_resend_or_smtp(to_email, subject, body)
+    queue_email(to_email, subject, body)
 
 def send_verified_email(to_email: str):
     """
@@ -805,7 +1574,7 @@ Welcome to Star4ce!
 – Star4ce
 """
 
-    send_email_via_resend_or_smtp(to_email, subject, body)
+    queue_email(to_email, subject, body)
 
 def send_reset_email(to_email: str, code: str):
     """
@@ -834,7 +1603,7 @@ If you did not request this, you can ignore this email.
     if os.getenv("ENVIRONMENT") != "production":
         print(f"[EMAIL DEBUG] Reset code for {to_email}: {code}", flush=True)
     
-    send_email_via_resend_or_smtp(to_email, subject, body)
+    queue_email(to_email, subject, body)
 
 def send_survey_invite_email(to_email: str, code: str):
     """
@@ -860,20 +1629,25 @@ Thank you for your honest feedback.
 – Star4ce
 """
 
-    send_email_via_resend_or_smtp(to_email, subject, body)
+    queue_email(to_email, subject, body)
 
 # Input validation helpers
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+_PHONE_STRIP_RE = re.compile(r'[\s\-\(\)\.]')
+_HAS_LETTER_RE = re.compile(r'[a-zA-Z]')
+_HAS_DIGIT_RE = re.compile(r'\d')
+_CONTROL_CHARS_RE = re.compile(r'[\x00-\x1f\x7f-\x9f]')
+
 def validate_email(email: str) -> bool:
     """Validate email format"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return bool(re.match(pattern, email))
+    return bool(_EMAIL_RE.match(email))
 
 def validate_phone(phone: str) -> bool:
     """Validate phone number format (basic validation)"""
     if not phone:
         return True  # Phone is optional
     # Remove common formatting characters
-    cleaned = re.sub(r'[\s\-\(\)\.]', '', phone)
+    cleaned = _PHONE_STRIP_RE.sub('', phone)
     # Check if it's all digits and reasonable length (10-15 digits)
     return cleaned.isdigit() and 10 <= len(cleaned) <= 15
 
@@ -882,8 +1656,8 @@ def validate_password(password: str) -> bool:
     if len(password) < 8:
         return False
     # At least one letter and one number
-    has_letter = bool(re.search(r'[a-zA-Z]', password))
-    has_number = bool(re.search(r'\d', password))
+    has_letter = bool(_HAS_LETTER_RE.search(password))
+    has_number = bool(_HAS_DIGIT_RE.search(password))
     return has_letter and has_number
 
 def sanitize_input(text: str, max_length: int = 255) -> str:
@@ -891,7 +1665,9 @@ def sanitize_input(text: str, max_length: int = 255) -> str:
     if not text:
         return ""
     # Remove null bytes and control characters
-    text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)
+    # (printable ASCII has none, so the common case skips the regex)
+    if not (text.isascii() and text.isprintable()):
+        text = _CONTROL_CHARS_RE.sub('', text)
     # Trim and limit length
     return text.strip()[:max_length]
 
@@ -933,6 +1709,16 @@ def generate_csv_response(data: list, filename: str) -> Response:
     response.headers['Content-Disposition'] = f'attachment; filename={filename}'
     return response
 
+def dumps_json(obj):
+    """Serialize to JSON with orjson when installed (bytes), else stdlib json (str)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj)
+
+def json_text(obj) -> str:
+    """dumps_json as str, for building JSON text by hand"""
+    return orjson.dumps(obj).decode() if ORJSON_AVAILABLE else json.dumps(obj)
+
 # ---- AUTH STUB (no DB yet) ----
 @app.post("/auth/login")
 @limiter.limit("5 per minute")
@@ -957,9 +1743,13 @@ def login():
 
     # Check password first (before checking verification status)
     # This way we can give better feedback
-    if not check_password_hash(user.password_hash, password):
+    if not verify_password(user.email, user.password_hash, password):
         return jsonify(error="invalid credentials"), 401
 
+    if password_needs_rehash(user.password_hash):
+        user.password_hash = hash_password(password)
+        db.session.commit()
+
     # Auto-upgrade users with active subscriptions to admin
     # This handles cases where webhook didn't fire or user subscribed before webhook was set up
     if user.role == "manager" and user.dealership_id:
@@ -1004,12 +1794,13 @@ def login():
     # Password is correct, now check verification
     if not user.is_verified:
         # generate a fresh verification code and resend
-        code_int = secrets.randbelow(1_000_000)  # 0..999999
-        verification_code = f"{code_int:06d}"
-        expires_at = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
-
-        user.verification_code = verification_code
-        user.verification_expires_at = expires_at
+        verification_code, retry_after = issue_verification_code(user)
+        if retry_after:
+            # A code went out recently; keep it valid instead of sending another
+            return jsonify(
+                error="unverified",
+                message="Your email is not verified yet. Please use the verification code we recently sent to your email."
+            ), 403
         db.session.commit()
 
         send_verification_email(user.email, verification_code)
@@ -1101,8 +1892,7 @@ def register():
                 return jsonify(error="Invalid dealership selected"), 400
 
         # Generate 6-digit verification code
-        code_int = secrets.randbelow(1_000_000)  # 0..999999
-        verification_code = f"{code_int:06d}"
+        verification_code = generate_six_digit_code()
         expires_at = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
 
         # Get full_name for admin registration
@@ -1112,7 +1902,7 @@ def register():
         
         user = User(
             email=email,
-            password_hash=generate_password_hash(password),
+            password_hash=hash_password(password),
             role=role,
             full_name=full_name,
             dealership_id=None,  # Managers don't get assigned directly - they must request access
@@ -1167,29 +1957,15 @@ def register():
 @app.get("/auth/me")
 def me():
     """Verify token and return user info"""
-    auth = request.headers.get("authorization", "") or request.headers.get("Authorization", "")
-    if not auth.startswith("Bearer "):
-        return jsonify(error="missing bearer token"), 401
-    
-    token = auth.split(" ", 1)[1].strip()
-    if not token:
-        return jsonify(error="empty token"), 401
+    user, err = authenticate_request()
+    if err:
+        return err
     
     try:
-        claims = verify_token(token)
-        # Also verify user exists and is verified
-        email = claims.get("sub")
-        if not email:
-            return jsonify(error="invalid token payload"), 401
-        
-        user = User.query.filter_by(email=email).first()
-        if not user:
-            return jsonify(error="user not found"), 401
-        
         # Auto-upgrade users with active subscriptions to admin
         # This handles cases where webhook didn't fire or user subscribed before webhook was set up
         if user.role == "manager" and user.dealership_id:
-            dealership = Dealership.query.get(user.dealership_id)
+            dealership = user.dealership  # joined-loaded with the user
             if dealership and dealership.is_subscription_active():
                 # User has active subscription but is still manager - upgrade to admin
                 user.role = "admin"
@@ -1285,6 +2061,37 @@ def me():
         print(f"[AUTH ERROR] /auth/me failed: {e}", flush=True)
         return jsonify(error="invalid token"), 401
     
+# Answer label -> numeric score used by the analytics averages
+SCORE_MAP = {
+    "Very Satisfied": 5,
+    "Satisfied": 4,
+    "Neutral": 3,
+    "Dissatisfied": 2,
+    "Very Dissatisfied": 1,
+}
+
+def time_bucket(column, group_by: str):
+    """
+    SQL expression that formats a timestamp as its day/week/month bucket label
+    ("YYYY-MM-DD", week starting Monday as "YYYY-MM-DD", or "YYYY-MM").
+    """
+    if DB_DIALECT == "postgresql":
+        if group_by == "day":
+            return func.to_char(column, "YYYY-MM-DD")
+        if group_by == "week":
+            return func.to_char(func.date_trunc("week", column), "YYYY-MM-DD")
+        return func.to_char(column, "YYYY-MM")
+    if group_by == "day":
+        return func.strftime("%Y-%m-%d", column)
+    if group_by == "week":
+        return func.date(column, "weekday 0", "-6 days")
+    return func.strftime("%Y-%m", column)
+
+def score_answers(answers) -> tuple:
+    """(sum, count) of the answers that map to a score in SCORE_MAP"""
+    scores = [SCORE_MAP[a] for a in (answers or {}).values() if a in SCORE_MAP]
+    return sum(scores), len(scores)
+
 @app.get("/analytics/time-series")
 @limiter.limit("30 per minute")
 def analytics_time_series():
@@ -1330,27 +2137,16 @@ def analytics_time_series():
             )
         )
 
-    # Group by time period
-    responses = base_q.order_by(SurveyResponse.created_at.asc()).all()
-    
-    # Group responses by time period
-    time_series = {}
-    for resp in responses:
-        if group_by == "day":
-            key = resp.created_at.strftime("%Y-%m-%d")
-        elif group_by == "week":
-            # Get week start (Monday)
-            week_start = resp.created_at - datetime.timedelta(days=resp.created_at.weekday())
-            key = week_start.strftime("%Y-%m-%d")
-        else:  # month
-            key = resp.created_at.strftime("%Y-%m")
-        
-        if key not in time_series:
-            time_series[key] = 0
-        time_series[key] += 1
+    # Group by time period in SQL; only one row per bucket comes back
+    bucket = time_bucket(SurveyResponse.created_at, group_by).label("bucket")
+    rows = (
+        base_q.with_entities(bucket, func.count(SurveyResponse.id))
+        .group_by(bucket)
+        .order_by(bucket)
+        .all()
+    )
 
-    # Convert to sorted list
-    items = [{"date": k, "count": v} for k, v in sorted(time_series.items())]
+    items = [{"date": date, "count": count} for date, count in rows]
 
     return jsonify(ok=True, items=items, group_by=group_by, days=days)
 
@@ -1394,42 +2190,25 @@ def analytics_averages():
             )
         )
 
-    responses = base_q.all()
-
-    # Calculate averages
-    satisfaction_scores = []
-    training_scores = []
-
-    for resp in responses:
-        if resp.satisfaction_answers:
-            # satisfaction_answers is a dict like {0: "Very Satisfied", 1: "Satisfied", ...}
-            # Map to numeric scores: Very Satisfied=5, Satisfied=4, Neutral=3, Dissatisfied=2, Very Dissatisfied=1
-            score_map = {
-                "Very Satisfied": 5,
-                "Satisfied": 4,
-                "Neutral": 3,
-                "Dissatisfied": 2,
-                "Very Dissatisfied": 1,
-            }
-            for answer in resp.satisfaction_answers.values():
-                if answer in score_map:
-                    satisfaction_scores.append(score_map[answer])
-
-        if resp.training_answers:
-            for answer in resp.training_answers.values():
-                if answer in score_map:
-                    training_scores.append(score_map[answer])
+    # Scores are stored per response at submit time, so this is a single SUM
+    total_responses, satisfaction_sum, satisfaction_count, training_sum, training_count = base_q.with_entities(
+        func.count(SurveyResponse.id),
+        func.coalesce(func.sum(SurveyResponse.satisfaction_sum), 0),
+        func.coalesce(func.sum(SurveyResponse.satisfaction_count), 0),
+        func.coalesce(func.sum(SurveyResponse.training_sum), 0),
+        func.coalesce(func.sum(SurveyResponse.training_count), 0),
+    ).one()
 
-    satisfaction_avg = sum(satisfaction_scores) / len(satisfaction_scores) if satisfaction_scores else 0
-    training_avg = sum(training_scores) / len(training_scores) if training_scores else 0
+    satisfaction_avg = satisfaction_sum / satisfaction_count if satisfaction_count else 0
+    training_avg = training_sum / training_count if training_count else 0
 
     return jsonify(
         ok=True,
         satisfaction_avg=round(satisfaction_avg, 2),
         training_avg=round(training_avg, 2),
-        total_responses=len(responses),
-        satisfaction_count=len(satisfaction_scores),
-        training_count=len(training_scores),
+        total_responses=total_responses,
+        satisfaction_count=satisfaction_count,
+        training_count=training_count,
     )
 
 @app.get("/analytics/role-breakdown")
@@ -1472,20 +2251,25 @@ def analytics_role_breakdown():
             )
         )
 
-    responses = base_q.all()
+    # Histogram in SQL: one row per (role, status) pair
+    rows = (
+        base_q.with_entities(SurveyResponse.role, SurveyResponse.employee_status, func.count(SurveyResponse.id))
+        .group_by(SurveyResponse.role, SurveyResponse.employee_status)
+        .all()
+    )
 
     # Group by role
     breakdown = {}
-    for resp in responses:
-        role = resp.role or "Unknown"
+    for role, employee_status, count in rows:
+        role = role or "Unknown"
         if role not in breakdown:
             breakdown[role] = {
                 "count": 0,
                 "by_status": {"newly-hired": 0, "termination": 0, "leave": 0, "none": 0},
             }
-        breakdown[role]["count"] += 1
-        if resp.employee_status in breakdown[role]["by_status"]:
-            breakdown[role]["by_status"][resp.employee_status] += 1
+        breakdown[role]["count"] += count
+        if employee_status in breakdown[role]["by_status"]:
+            breakdown[role]["by_status"][employee_status] += count
 
     return jsonify(ok=True, breakdown=breakdown)
 
@@ -1509,8 +2293,7 @@ def analytics_summary():
 
         # Check subscription limits for admin users
         if user.role == "admin" and user.dealership_id:
-            dealership = Dealership.query.get(user.dealership_id)
-            if dealership and not dealership.is_subscription_active():
+            if subscription_active(user.dealership_id) is False:
                 return jsonify(
                     error="subscription_expired",
                     message="Your subscription has expired. Please renew to view analytics."
@@ -1544,8 +2327,11 @@ def analytics_summary():
                 .filter(SurveyAccessCode.dealership_id.in_(accessible_dealership_ids))
             )
             
-            total_responses = base_q.count()
-            last_30 = base_q.filter(SurveyResponse.created_at >= cutoff_30).count()
+            # Total and last-30-days counts in one pass
+            total_responses, last_30 = base_q.with_entities(
+                func.count(SurveyResponse.id),
+                func.count(SurveyResponse.id).filter(SurveyResponse.created_at >= cutoff_30),
+            ).one()
 
             return jsonify(
                 ok=True,
@@ -1575,16 +2361,16 @@ def analytics_summary():
             .filter(SurveyAccessCode.dealership_id == user.dealership_id)
         )
 
-        total_responses = base_q.count()
-        last_30 = base_q.filter(SurveyResponse.created_at >= cutoff_30).count()
-
-        # small breakdown by employee_status
-        status_counts = {
-            "newly-hired": base_q.filter(SurveyResponse.employee_status == "newly-hired").count(),
-            "termination": base_q.filter(SurveyResponse.employee_status == "termination").count(),
-            "leave": base_q.filter(SurveyResponse.employee_status == "leave").count(),
-            "none": base_q.filter(SurveyResponse.employee_status == "none").count(),
-        }
+        # Totals and the small employee_status breakdown as conditional
+        # aggregates: one scan, one result row
+        statuses = ("newly-hired", "termination", "leave", "none")
+        counts = base_q.with_entities(
+            func.count(SurveyResponse.id),
+            func.count(SurveyResponse.id).filter(SurveyResponse.created_at >= cutoff_30),
+            *(func.count(SurveyResponse.id).filter(SurveyResponse.employee_status == status) for status in statuses),
+        ).one()
+        total_responses, last_30 = counts[0], counts[1]
+        status_counts = dict(zip(statuses, counts[2:]))
 
         return jsonify(
             ok=True,
@@ -1595,11 +2381,10 @@ def analytics_summary():
             last_30_days=last_30,
             by_status=status_counts,
         )
-    except Exception as e:
-        print(f"[ANALYTICS ERROR] Error in analytics_summary: {e}", flush=True)
-        import traceback
-        traceback.print_exc()
-        return jsonify(error=f"Internal server error: {str(e)}"), 500
+    except SQLAlchemyError:
+        db.session.rollback()
+        logger.exception("analytics_summary failed")
+        return jsonify(error="Internal server error"), 500
 
 @app.get("/audit-logs")
 @limiter.limit("30 per minute")
@@ -1645,12 +2430,12 @@ def get_audit_logs():
         if resource_type_filter:
             query = query.filter_by(resource_type=resource_type_filter)
 
+        # Get total count before pagination (plain COUNT, no subquery over every column)
+        total_count = query.with_entities(func.count(AdminAuditLog.id)).scalar()
+
         # Order by most recent first
         query = query.order_by(AdminAuditLog.created_at.desc())
 
-        # Get total count before pagination
-        total_count = query.count()
-
         # Apply pagination
         logs = query.limit(limit).offset(offset).all()
 
@@ -1680,8 +2465,7 @@ def export_survey_responses():
 
     # Check subscription limits for admin users
     if user.role == "admin" and user.dealership_id:
-        dealership = Dealership.query.get(user.dealership_id)
-        if dealership and not dealership.is_subscription_active():
+        if subscription_active(user.dealership_id) is False:
             return jsonify(
                 error="subscription_expired",
                 message="Your subscription has expired. Please renew to export data."
@@ -1735,7 +2519,25 @@ def export_survey_responses():
                 .filter(SurveyAccessCode.dealership_id == user.dealership_id)
             )
 
-    responses = base_q.order_by(SurveyResponse.created_at.desc()).all()
+    # Project just the exported columns (no ORM objects) and fetch in batches
+    responses = (
+        base_q.with_entities(
+            SurveyResponse.id,
+            SurveyResponse.access_code,
+            SurveyResponse.employee_status,
+            SurveyResponse.role,
+            SurveyResponse.termination_reason,
+            SurveyResponse.termination_other,
+            SurveyResponse.leave_reason,
+            SurveyResponse.leave_other,
+            SurveyResponse.satisfaction_answers,
+            SurveyResponse.training_answers,
+            SurveyResponse.additional_feedback,
+            SurveyResponse.created_at,
+        )
+        .order_by(SurveyResponse.created_at.desc())
+        .yield_per(500)
+    )
 
     # Prepare data for CSV
     csv_data = []
@@ -1769,7 +2571,7 @@ def export_survey_responses():
         "export_survey_responses",
         "survey_response",
         None,
-        json.dumps({"count": len(csv_data), "days": days})
+        {"count": len(csv_data), "days": days}
     )
 
     return generate_csv_response(csv_data, filename)
@@ -1787,8 +2589,7 @@ def export_analytics():
 
     # Check subscription limits for admin users
     if user.role == "admin" and user.dealership_id:
-        dealership = Dealership.query.get(user.dealership_id)
-        if dealership and not dealership.is_subscription_active():
+        if subscription_active(user.dealership_id) is False:
             return jsonify(
                 error="subscription_expired",
                 message="Your subscription has expired. Please renew to export data."
@@ -1824,20 +2625,21 @@ def export_analytics():
             )
         )
 
-    responses = base_q.all()
+    rows = base_q.with_entities(SurveyResponse.employee_status, SurveyResponse.role).yield_per(500)
 
     # Calculate analytics
-    total_responses = len(responses)
+    total_responses = 0
     status_counts = {"newly-hired": 0, "termination": 0, "leave": 0, "none": 0}
     role_counts = {}
     
-    for resp in responses:
+    for employee_status, role in rows:
+        total_responses += 1
         # Count by status
-        if resp.employee_status in status_counts:
-            status_counts[resp.employee_status] += 1
+        if employee_status in status_counts:
+            status_counts[employee_status] += 1
         
         # Count by role
-        role = resp.role or "Unknown"
+        role = role or "Unknown"
         role_counts[role] = role_counts.get(role, 0) + 1
 
     # Prepare data for CSV
@@ -1863,7 +2665,7 @@ def export_analytics():
         "export_analytics",
         "analytics",
         None,
-        json.dumps({"days": days, "total_responses": total_responses})
+        {"days": days, "total_responses": total_responses}
     )
 
     return generate_csv_response(csv_data, filename)
@@ -1888,16 +2690,18 @@ def verify_email():
     if user.is_verified:
         return jsonify(ok=True, message="Already verified")
 
-    if user.verification_code != code:
+    status = one_time_code_status(user, "verify_code", code)
+    if status == "invalid":
         return jsonify(error="Invalid verification code. Please check and try again."), 400
 
-    if user.verification_expires_at and user.verification_expires_at < datetime.datetime.utcnow():
+    if status == "expired":
         return jsonify(error="Verification code has expired. Please request a new one."), 400
 
     user.is_verified = True
-    user.verification_code = None
-    user.verification_expires_at = None
+    clear_one_time_code(user, "verify_code")
     db.session.commit()
+    invalidate_user_cache([email])
+    reset_verification_email_quota(user.id)
 
     # Check if this is an admin registration (manager role, no dealership, not approved yet, no pending request)
     # Admin registration = manager with no dealership and no pending manager request
@@ -1952,12 +2756,15 @@ def resend_verify():
         return jsonify(error="already verified"), 400
 
     # New 6-digit code
-    code_int = secrets.randbelow(1_000_000)
-    verification_code = f"{code_int:06d}"
-    expires_at = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
-
-    user.verification_code = verification_code
-    user.verification_expires_at = expires_at
+    verification_code, retry_after = issue_verification_code(user)
+    if retry_after:
+        response = jsonify(
+            error="too_many_requests",
+            message="A verification code was sent recently. Please check your email or try again later.",
+            retry_after=retry_after,
+        )
+        response.headers["Retry-After"] = str(retry_after)
+        return response, 429
     db.session.commit()
 
     send_verification_email(user.email, verification_code)
@@ -1982,11 +2789,9 @@ def request_reset():
         return jsonify(error="no account with that email"), 404
 
     # Generate a 6-digit reset code
-    reset_code = f"{random.randint(0, 999999):06d}"
-    expires_at = datetime.datetime.utcnow() + datetime.timedelta(minutes=10)
-
-    user.reset_code = reset_code
-    user.reset_code_expires_at = expires_at
+    reset_code = generate_six_digit_code()
+    expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=RESET_CODE_TTL_SECONDS)
+    store_one_time_code(user, "reset_code", reset_code, RESET_CODE_TTL_SECONDS)
     db.session.commit()
 
     # Send via email
@@ -1996,7 +2801,7 @@ def request_reset():
     return jsonify(
         ok=True,
         reset_code=reset_code,
-        expires_at=expires_at.isoformat() + "Z",
+        expires_at=iso_utc(expires_at),
     )
 
 @app.post("/auth/reset")
@@ -2017,18 +2822,19 @@ def reset_password():
         return jsonify(error="password must be at least 8 characters with letters and numbers"), 400
 
     user = User.query.filter_by(email=email).first()
-    if not user or not user.reset_code or user.reset_code != code:
+    status = one_time_code_status(user, "reset_code", code) if user else "invalid"
+    if status == "invalid":
         return jsonify(error="invalid code or email"), 400
 
     # Check expiration
-    if user.reset_code_expires_at and user.reset_code_expires_at < datetime.datetime.utcnow():
+    if status == "expired":
         return jsonify(error="reset code expired"), 400
 
     # Update password
-    user.password_hash = generate_password_hash(new_password)
-    user.reset_code = None
-    user.reset_code_expires_at = None
+    user.password_hash = hash_password(new_password)
+    clear_one_time_code(user, "reset_code")
     db.session.commit()
+    invalidate_user_cache([email])
 
     # Optional: log them in immediately with a new token
     token = make_token(user.email, user.role)
@@ -2040,13 +2846,87 @@ def reset_password():
         role=user.role,
     )
 
-def generate_access_code(length: int = 8) -> str:
+ACCESS_CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+ACCESS_CODE_LENGTH = 8
+_ACCESS_CODE_RE = re.compile(f"[{ACCESS_CODE_ALPHABET}]{{{ACCESS_CODE_LENGTH}}}")
+
+# Redis set of active access codes, so guessed/garbage codes never reach the DB.
+# The sentinel member marks the set as fully loaded; it can't collide with a real code.
+ACTIVE_CODES_KEY = "active_codes"
+ACTIVE_CODES_LOADED = "*"
+
+def generate_access_code(length: int = ACCESS_CODE_LENGTH) -> str:
     """
     Generate a human-friendly code: no 0/O/1/I to avoid confusion.
     Example: 7K2F9QBD
     """
-    alphabet = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
-    return "".join(secrets.choice(alphabet) for _ in range(length))
+    # One urandom call; the alphabet has exactly 32 symbols, so masking to 5 bits is unbiased
+    return "".join(ACCESS_CODE_ALPHABET[b & 31] for b in secrets.token_bytes(length))
+
+def normalize_access_code(raw) -> str:
+    """Codes are typed by hand: ignore surrounding whitespace and letter case"""
+    return (raw or "").strip().upper()
+
+def access_code_well_formed(code: str) -> bool:
+    """True if code could have come from generate_access_code"""
+    return _ACCESS_CODE_RE.fullmatch(code) is not None
+
+def access_code_maybe_active(code: str) -> bool:
+    """
+    False only when the Redis set of active codes is loaded and doesn't contain code.
+    Without Redis (or if it's unreachable/evicted) we can't tell, so the DB decides.
+    """
+    if redis_client is None:
+        return True
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.sismember(ACTIVE_CODES_KEY, code)
+        pipe.sismember(ACTIVE_CODES_KEY, ACTIVE_CODES_LOADED)
+        is_member, loaded = pipe.execute()
+    except Exception as e:
+        print(f"[ACCESS CODES] Redis lookup failed: {e}", flush=True)
+        return True
+    return bool(is_member) or not loaded
+
+def remember_active_code(*codes: str):
+    """
+    Add new codes to the Redis set. If that fails the set no longer lists every
+    active code, so drop the loaded sentinel and let lookups fall back to the DB.
+    """
+    if redis_client is None or not codes:
+        return
+    try:
+        redis_client.sadd(ACTIVE_CODES_KEY, *codes)
+    except Exception as e:
+        print(f"[ACCESS CODES] Redis SADD failed, disabling set lookups: {e}", flush=True)
+        try:
+            redis_client.srem(ACTIVE_CODES_KEY, ACTIVE_CODES_LOADED)
+        except Exception as e2:
+            # Redis is unreachable, so lookups fail open to the DB anyway
+            print(f"[ACCESS CODES] Redis SREM of sentinel failed: {e2}", flush=True)
+
+def forget_active_code(code: str):
+    if redis_client is None:
+        return
+    try:
+        redis_client.srem(ACTIVE_CODES_KEY, code)
+    except Exception as e:
+        print(f"[ACCESS CODES] Redis SREM failed: {e}", flush=True)
+
+def warm_active_code_cache():
+    """Load every active code into the Redis set, then mark it as loaded"""
+    if redis_client is None:
+        return
+    codes = [code for (code,) in db.session.query(SurveyAccessCode.code).filter(SurveyAccessCode.is_active == True)]
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for i in range(0, len(codes), 1000):
+            pipe.sadd(ACTIVE_CODES_KEY, *codes[i:i + 1000])
+        pipe.sadd(ACTIVE_CODES_KEY, ACTIVE_CODES_LOADED)
+        pipe.execute()
+        print(f"[ACCESS CODES] Cached {len(codes)} active codes in Redis", flush=True)
+    except Exception as e:
+        print(f"[ACCESS CODES] Failed to warm Redis cache: {e}", flush=True)
 
 @app.post("/survey/access-codes")
 def create_access_code():
@@ -2066,55 +2946,31 @@ def create_access_code():
 
         # Check subscription limits
         if user.dealership_id:
-            dealership = Dealership.query.get(user.dealership_id)
-            if dealership and not dealership.is_subscription_active():
+            if subscription_active(user.dealership_id) is False:
                 return jsonify(
                     error="subscription_expired",
                     message="Your subscription has expired. Please renew to create access codes."
                 ), 403
 
-        # If admin doesn't have a dealership, create one automatically
-        if not user.dealership_id:
-            # Create a default dealership for this admin with 14-day trial
+        # If admin has no dealership (or it was deleted), create one with a
+        # 14-day trial; it's committed together with the access code below
+        dealership = db.session.get(Dealership, user.dealership_id) if user.dealership_id else None
+        if dealership is None:
             now = datetime.datetime.utcnow()
             dealership = Dealership(
                 name=f"Dealership for {user.email}",
                 address=None,
-                subscription_status="trial",
-                trial_ends_at=now + datetime.timedelta(days=14),
                 city=None,
                 state=None,
                 zip_code=None,
+                subscription_status="trial",
+                trial_ends_at=now + datetime.timedelta(days=14),
                 created_at=now,
                 updated_at=now,
             )
             db.session.add(dealership)
             db.session.flush()  # Get the ID without committing
-            
-            # Assign the dealership to the admin
             user.dealership_id = dealership.id
-            db.session.commit()
-        else:
-            # Ensure the dealership still exists
-            dealership = Dealership.query.get(user.dealership_id)
-            if not dealership:
-                # Dealership was deleted, create a new one
-                now = datetime.datetime.utcnow()
-                dealership = Dealership(
-                    name=f"Dealership for {user.email}",
-                    address=None,
-                    city=None,
-                    state=None,
-                    zip_code=None,
-                    subscription_status="trial",
-                    trial_ends_at=now + datetime.timedelta(days=14),
-                    created_at=now,
-                    updated_at=now,
-                )
-                db.session.add(dealership)
-                db.session.flush()
-                user.dealership_id = dealership.id
-                db.session.commit()
 
         # Optional: read an expiry from the request body (in hours), else None
         data = request.get_json(silent=True) or {}
@@ -2123,16 +2979,26 @@ def create_access_code():
         if isinstance(hours, (int, float)) and hours > 0:
             expires_at = datetime.datetime.utcnow() + datetime.timedelta(hours=hours)
 
-        code = generate_access_code()
-
-        access = SurveyAccessCode(
-            code=code,
-            dealership_id=user.dealership_id,
-            expires_at=expires_at,
-            is_active=True,
-        )
-        db.session.add(access)
+        # The UNIQUE constraint on code is the collision check: insert inside a
+        # SAVEPOINT and draw a new code if it's already taken (1 in ~1e12)
+        for attempt in range(5):
+            access = SurveyAccessCode(
+                code=generate_access_code(),
+                dealership_id=user.dealership_id,
+                expires_at=expires_at,
+                is_active=True,
+            )
+            try:
+                with db.session.begin_nested():
+                    db.session.add(access)
+                break
+            except IntegrityError:
+                print(f"[CREATE ACCESS CODE] Code collision, retrying ({attempt + 1}/5)", flush=True)
+        else:
+            db.session.rollback()
+            return jsonify(error="could not generate a unique access code, please try again"), 503
         db.session.commit()
+        remember_active_code(access.code)
 
         # Log admin action
         log_admin_action(
@@ -2140,7 +3006,7 @@ def create_access_code():
             "create_access_code",
             "access_code",
             access.id,
-            json.dumps({"code": access.code, "expires_at": access.expires_at.isoformat() + "Z" if access.expires_at else None})
+            {"code": access.code, "expires_at": iso_utc(access.expires_at)}
         )
 
         return jsonify(
@@ -2148,22 +3014,25 @@ def create_access_code():
             id=access.id,
             code=access.code,
             dealership_id=access.dealership_id,
-            created_at=access.created_at.isoformat() + "Z",
-            expires_at=access.expires_at.isoformat() + "Z" if access.expires_at else None,
+            created_at=iso_utc(access.created_at),
+            expires_at=iso_utc(access.expires_at),
             is_active=access.is_active,
         )
-    except Exception as e:
-        print(f"[CREATE ACCESS CODE ERROR] {e}", flush=True)
-        import traceback
-        traceback.print_exc()
+    except SQLAlchemyError:
         db.session.rollback()
-        return jsonify(error=f"Failed to create access code: {str(e)}"), 500
+        logger.exception("create_access_code failed")
+        return jsonify(error="Failed to create access code"), 500
 
 @app.get("/survey/access-codes")
 def list_access_codes():
     """
-    Returns all survey access codes for the user's dealership.
+    Returns survey access codes for the user's dealership, newest first.
     Requires 'view_surveys' permission.
+
+    Query parameters:
+    - limit / offset: page window (default limit 100, max 500)
+    - active: "true" / "false" to filter on is_active (optional)
+    - q: code prefix (optional)
     """
     user, err = get_current_user()
     if err:
@@ -2178,24 +3047,44 @@ def list_access_codes():
         return jsonify(
             ok=True,
             items=[],
+            total=0,
         )
 
+    try:
+        limit = max(1, min(int(request.args.get("limit", 100)), 500))
+        offset = max(0, int(request.args.get("offset", 0)))
+    except ValueError:
+        return jsonify(error="invalid limit or offset"), 400
+
+    query = SurveyAccessCode.query.filter_by(dealership_id=user.dealership_id)
+    active = request.args.get("active")
+    if active in ("true", "false"):
+        query = query.filter(SurveyAccessCode.is_active == (active == "true"))
+    q = (request.args.get("q") or "").strip().upper()
+    if q:
+        query = query.filter(SurveyAccessCode.code.startswith(q, autoescape=True))
+
+    total = query.with_entities(func.count(SurveyAccessCode.id)).scalar()
     codes = (
-        SurveyAccessCode.query
-        .filter_by(dealership_id=user.dealership_id)
-        .order_by(SurveyAccessCode.created_at.desc())
+        query
+        .order_by(SurveyAccessCode.created_at.desc(), SurveyAccessCode.id.desc())
+        .limit(limit)
+        .offset(offset)
         .all()
     )
 
     return jsonify(
         ok=True,
+        total=total,
+        limit=limit,
+        offset=offset,
         items=[
             {
                 "id": c.id,
                 "code": c.code,
                 "dealership_id": c.dealership_id,
-                "created_at": c.created_at.isoformat() + "Z",
-                "expires_at": c.expires_at.isoformat() + "Z" if c.expires_at else None,
+                "created_at": iso_utc(c.created_at),
+                "expires_at": iso_utc(c.expires_at),
                 "is_active": c.is_active,
             }
             for c in codes
@@ -2265,7 +3154,7 @@ def survey_invite():
         "invite_employee_survey",
         "employee",
         None,
-        json.dumps({"email": to_email, "code": code})
+        {"email": to_email, "code": code}
     )
 
     return jsonify(
@@ -2275,35 +3164,137 @@ def survey_invite():
         dealership_id=user.dealership_id,
     )
 
-# ===== EMPLOYEE MANAGEMENT ENDPOINTS (Admin only) =====
+BULK_INVITE_LIMIT = 200
 
-@app.post("/employees")
-@limiter.limit("20 per minute")
-def create_employee():
-    """Admin-only: Create a new employee for their dealership"""
+@app.post("/survey/bulk-invite")
+@limiter.limit("10 per minute")
+def survey_bulk_invite():
+    """
+    Invites a list of emails in one request. Codes are single-use, so every
+    recipient gets their own: all rows go in with one multi-row INSERT and
+    one commit, then each recipient is emailed their code.
+    """
     user, err = get_current_user()
     if err:
         return err
 
+    if not has_permission(user, "create_survey"):
+        return jsonify(error="you do not have permission to create surveys"), 403
+
     if user.role != "admin":
-        return jsonify(error="only admins can manage employees"), 403
+        return jsonify(error="forbidden – only admin can send survey invites"), 403
 
     if not user.dealership_id:
         return jsonify(error="admin has no dealership assigned"), 400
 
-    # Check subscription limits
-    dealership = Dealership.query.get(user.dealership_id)
-    if dealership and not dealership.is_subscription_active():
+    if subscription_active(user.dealership_id) is False:
         return jsonify(
             error="subscription_expired",
-            message="Your subscription has expired. Please renew to manage employees."
+            message="Your subscription has expired. Please renew to create access codes."
         ), 403
 
     data = request.get_json(force=True) or {}
-    name = sanitize_input(data.get("name") or "", max_length=255)
-    email = sanitize_input(data.get("email") or "").strip().lower()
-    phone = sanitize_input(data.get("phone") or "", max_length=20)
-    department = sanitize_input(data.get("department") or "", max_length=100)
+    emails = data.get("emails")
+    if not isinstance(emails, list) or not emails:
+        return jsonify(error="a non-empty emails list is required"), 400
+
+    # Normalize + de-duplicate, keeping the caller's order
+    recipients = list(dict.fromkeys(
+        e.strip().lower() for e in emails if isinstance(e, str) and e.strip()
+    ))
+    if len(recipients) > BULK_INVITE_LIMIT:
+        return jsonify(error=f"at most {BULK_INVITE_LIMIT} emails per request"), 400
+    invalid = [e for e in recipients if not validate_email(e)]
+    if invalid:
+        return jsonify(error="invalid email address", invalid=invalid), 400
+
+    hours = data.get("expires_in_hours")
+    expires_at = None
+    if isinstance(hours, (int, float)) and hours > 0:
+        expires_at = datetime.datetime.utcnow() + datetime.timedelta(hours=hours)
+
+    # As in create_access_code, the UNIQUE constraint is the collision check:
+    # insert the whole batch in a SAVEPOINT and redraw it if any code is taken
+    try:
+        for attempt in range(5):
+            codes = set()
+            while len(codes) < len(recipients):
+                codes.add(generate_access_code())
+            now = datetime.datetime.utcnow()
+            rows = [
+                {
+                    "code": code,
+                    "dealership_id": user.dealership_id,
+                    "created_at": now,
+                    "expires_at": expires_at,
+                    "is_active": True,
+                }
+                for code in codes
+            ]
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(SurveyAccessCode.__table__.insert(), rows)
+                break
+            except IntegrityError:
+                print(f"[BULK INVITE] Code collision, retrying ({attempt + 1}/5)", flush=True)
+        else:
+            db.session.rollback()
+            return jsonify(error="could not generate unique access codes, please try again"), 503
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        logger.exception("survey_bulk_invite failed")
+        return jsonify(error="Failed to create access codes"), 500
+
+    remember_active_code(*codes)
+    invites = [{"email": e, "code": c} for e, c in zip(recipients, codes)]
+    for invite in invites:
+        send_survey_invite_email(invite["email"], invite["code"])
+
+    log_admin_action(
+        user.email,
+        "bulk_invite_employee_survey",
+        "employee",
+        None,
+        {"count": len(invites), "expires_at": iso_utc(expires_at)}
+    )
+
+    return jsonify(
+        ok=True,
+        message=f"Survey invite sent to {len(invites)} recipients",
+        sent=len(invites),
+        invites=invites,
+        expires_at=iso_utc(expires_at),
+    )
+
+# ===== EMPLOYEE MANAGEMENT ENDPOINTS (Admin only) =====
+
+@app.post("/employees")
+@limiter.limit("20 per minute")
+def create_employee():
+    """Admin-only: Create a new employee for their dealership"""
+    user, err = get_current_user()
+    if err:
+        return err
+
+    if user.role != "admin":
+        return jsonify(error="only admins can manage employees"), 403
+
+    if not user.dealership_id:
+        return jsonify(error="admin has no dealership assigned"), 400
+
+    # Check subscription limits
+    if subscription_active(user.dealership_id) is False:
+        return jsonify(
+            error="subscription_expired",
+            message="Your subscription has expired. Please renew to manage employees."
+        ), 403
+
+    data = request.get_json(force=True) or {}
+    name = sanitize_input(data.get("name") or "", max_length=255)
+    email = sanitize_input(data.get("email") or "").strip().lower()
+    phone = sanitize_input(data.get("phone") or "", max_length=20)
+    department = sanitize_input(data.get("department") or "", max_length=100)
     position = sanitize_input(data.get("position") or "", max_length=100)
 
     if not name or not email or not department:
@@ -2334,7 +3325,12 @@ def create_employee():
     )
 
     db.session.add(employee)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Concurrent create with the same email (unique per dealership)
+        db.session.rollback()
+        return jsonify(error="An employee with this email already exists"), 400
 
     # Log admin action
     log_admin_action(
@@ -2342,7 +3338,7 @@ def create_employee():
         "create_employee",
         "employee",
         employee.id,
-        json.dumps({"name": employee.name, "email": employee.email, "department": employee.department})
+        {"name": employee.name, "email": employee.email, "department": employee.department}
     )
 
     return jsonify(ok=True, employee=employee.to_dict()), 201
@@ -2350,7 +3346,15 @@ def create_employee():
 @app.get("/employees")
 @limiter.limit("30 per minute")
 def list_employees():
-    """Admin-only: List all employees for their dealership"""
+    """
+    Admin-only: List employees for their dealership, newest first.
+
+    Query parameters:
+    - limit: page size (default: 100, max: 500)
+    - cursor: next_cursor value from the previous page (optional)
+    - active: "true" / "false" to filter on is_active (optional)
+    - q: case-insensitive match on name or email (optional)
+    """
     user, err = get_current_user()
     if err:
         return err
@@ -2359,16 +3363,61 @@ def list_employees():
         return jsonify(error="only admins can view employees"), 403
 
     if not user.dealership_id:
-        return jsonify(ok=True, items=[])
+        return jsonify(ok=True, items=[], total=0, next_cursor=None)
 
-    employees = Employee.query.filter_by(
-        dealership_id=user.dealership_id
-    ).order_by(Employee.created_at.desc()).all()
-
-    return jsonify(
-        ok=True,
-        items=[e.to_dict() for e in employees]
+    try:
+        limit = max(1, min(int(request.args.get("limit", 100)), 500))
+    except ValueError:
+        return jsonify(error="invalid limit"), 400
+
+    filters = [Employee.dealership_id == user.dealership_id]
+    active = request.args.get("active")
+    if active in ("true", "false"):
+        filters.append(Employee.is_active == (active == "true"))
+    q = (request.args.get("q") or "").strip()
+    if q:
+        filters.append(or_(
+            Employee.name.icontains(q, autoescape=True),
+            Employee.email.icontains(q, autoescape=True),
+        ))
+
+    total = db.session.query(func.count(Employee.id)).filter(*filters).scalar()
+
+    # Keyset pagination on (created_at, id) so pages stay stable as rows are added
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = cursor.rsplit("|", 1)
+            cursor_created_at = datetime.datetime.fromisoformat(cursor_created_at)
+            cursor_id = int(cursor_id)
+        except ValueError:
+            return jsonify(error="invalid cursor"), 400
+        filters.append(or_(
+            Employee.created_at < cursor_created_at,
+            and_(Employee.created_at == cursor_created_at, Employee.id < cursor_id),
+        ))
+
+    # Plain column tuples (no ORM objects), shaped like Employee.to_dict()
+    columns = [getattr(Employee, name) for name in Employee._COLUMNS]
+    rows = (
+        db.session.query(*columns, Employee.created_at, Employee.updated_at)
+        .filter(*filters)
+        .order_by(Employee.created_at.desc(), Employee.id.desc())
+        .limit(limit)
+        .all()
     )
+    items = []
+    for row in rows:
+        item = dict(zip(Employee._COLUMNS, row))
+        item["created_at"] = iso_utc(row.created_at)
+        item["updated_at"] = iso_utc(row.updated_at)
+        items.append(item)
+
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = f"{rows[-1].created_at.isoformat()}|{rows[-1].id}"
+
+    return jsonify(ok=True, items=items, total=total, limit=limit, next_cursor=next_cursor)
 
 @app.get("/employees/export")
 @limiter.limit("10 per minute")
@@ -2385,8 +3434,7 @@ def export_employees():
         return jsonify(error="admin has no dealership assigned"), 400
 
     # Check subscription limits
-    dealership = Dealership.query.get(user.dealership_id)
-    if dealership and not dealership.is_subscription_active():
+    if subscription_active(user.dealership_id) is False:
         return jsonify(
             error="subscription_expired",
             message="Your subscription has expired. Please renew to export data."
@@ -2421,7 +3469,7 @@ def export_employees():
         "export_employees",
         "employee",
         None,
-        json.dumps({"count": len(csv_data)})
+        {"count": len(csv_data)}
     )
 
     return generate_csv_response(csv_data, filename)
@@ -2477,17 +3525,19 @@ def update_employee(employee_id: int):
     if "name" in data:
         employee.name = sanitize_input(data["name"], max_length=255)
     if "email" in data:
-        email = sanitize_input(data["email"]).strip().lower()
-        if not validate_email(email):
-            return jsonify(error="invalid email format"), 400
-        # Check if email is taken by another employee
-        existing = Employee.query.filter_by(
-            email=email,
-            dealership_id=user.dealership_id
-        ).filter(Employee.id != employee_id).first()
-        if existing:
-            return jsonify(error="email already in use"), 400
-        employee.email = email
+        email = sanitize_input(data["email"]).lower()
+        # Clients send the whole record back; only re-check an email that changed
+        if email != employee.email:
+            if not validate_email(email):
+                return jsonify(error="invalid email format"), 400
+            # Check if email is taken by another employee
+            existing = db.session.query(Employee.id).filter_by(
+                email=email,
+                dealership_id=user.dealership_id
+            ).filter(Employee.id != employee_id).first()
+            if existing:
+                return jsonify(error="email already in use"), 400
+            employee.email = email
     if "phone" in data:
         phone = sanitize_input(data["phone"], max_length=20) or None
         if phone and not validate_phone(phone):
@@ -2509,7 +3559,7 @@ def update_employee(employee_id: int):
         "update_employee",
         "employee",
         employee.id,
-        json.dumps({"changes": data})
+        {"changes": data}
     )
 
     return jsonify(ok=True, employee=employee.to_dict())
@@ -2547,7 +3597,7 @@ def delete_employee(employee_id: int):
         "delete_employee",
         "employee",
         employee.id,
-        json.dumps({"name": employee.name, "email": employee.email})
+        {"name": employee.name, "email": employee.email}
     )
 
     return jsonify(ok=True, message="employee deactivated")
@@ -2605,7 +3655,7 @@ def invite_employee_to_survey(employee_id: int):
         "invite_employee_survey",
         "employee",
         employee.id,
-        json.dumps({"email": employee.email, "code": code})
+        {"email": employee.email, "code": code}
     )
 
     return jsonify(
@@ -2618,11 +3668,15 @@ def invite_employee_to_survey(employee_id: int):
 @app.post("/survey/validate-code")
 def validate_access_code():
     data = request.get_json(force=True)
-    access_code = (data.get("access_code") or "").strip()
+    access_code = normalize_access_code(data.get("access_code"))
 
     if not access_code:
         return jsonify(error="access_code is required"), 400
 
+    # Reject malformed / unknown codes without touching the DB
+    if not access_code_well_formed(access_code) or not access_code_maybe_active(access_code):
+        return jsonify(error="invalid or inactive access code"), 400
+
     # Look up code in DB
     code_obj = SurveyAccessCode.query.filter_by(code=access_code).first()
 
@@ -2639,7 +3693,7 @@ def validate_access_code():
         ok=True,
         code=code_obj.code,
         dealership_id=code_obj.dealership_id,
-        expires_at=code_obj.expires_at.isoformat() + "Z" if code_obj.expires_at else None,
+        expires_at=iso_utc(code_obj.expires_at),
     )
 
 @app.post("/survey/submit")
@@ -2652,7 +3706,7 @@ def submit_survey():
     """
     data = request.get_json(force=True)
 
-    access_code = (data.get("access_code") or "").strip().upper()
+    access_code = normalize_access_code(data.get("access_code"))
     employee_status = (data.get("employee_status") or "").strip()
     role = (data.get("role") or "").strip()
 
@@ -2675,18 +3729,37 @@ def submit_survey():
     if training_answers and not isinstance(training_answers, dict):
         return jsonify(error="training_answers must be an object"), 400
 
-    # 🔹 1) Look up and validate the access code in the DB
-    ac = SurveyAccessCode.query.filter_by(code=access_code, is_active=True).first()
-    if not ac:
+    if not access_code_well_formed(access_code) or not access_code_maybe_active(access_code):
         return jsonify(error="Invalid or inactive access code"), 400
 
-    if ac.expires_at and ac.expires_at < datetime.datetime.utcnow():
-        return jsonify(error="This access code has expired"), 400
-
-    # 🔹 2) One-time use: immediately deactivate the code
-    ac.is_active = False
+    # 🔹 1) + 2) Validate and consume the one-time code in a single atomic UPDATE,
+    # so two concurrent submissions can't both use it
+    now = datetime.datetime.utcnow()
+    ac = db.session.execute(
+        update(SurveyAccessCode)
+        .where(
+            SurveyAccessCode.code == access_code,
+            SurveyAccessCode.is_active == True,
+            or_(SurveyAccessCode.expires_at.is_(None), SurveyAccessCode.expires_at >= now),
+        )
+        .values(is_active=False)
+        .returning(SurveyAccessCode.id, SurveyAccessCode.dealership_id)
+    ).first()
+    if ac is None:
+        # Nothing consumed: work out which error to report
+        expired = db.session.query(SurveyAccessCode.id).filter(
+            SurveyAccessCode.code == access_code,
+            SurveyAccessCode.is_active == True,
+            SurveyAccessCode.expires_at < now,
+        ).first()
+        db.session.rollback()
+        if expired:
+            return jsonify(error="This access code has expired"), 400
+        return jsonify(error="Invalid or inactive access code"), 400
 
     # 🔹 3) Save the structured response (for detailed analysis later)
+    satisfaction_sum, satisfaction_count = score_answers(satisfaction_answers)
+    training_sum, training_count = score_answers(training_answers)
     resp = SurveyResponse(
         access_code=access_code,
         employee_status=employee_status,
@@ -2698,6 +3771,10 @@ def submit_survey():
         leave_reason=leave_reason,
         leave_other=leave_other,
         additional_feedback=additional_feedback,
+        satisfaction_sum=satisfaction_sum,
+        satisfaction_count=satisfaction_count,
+        training_sum=training_sum,
+        training_count=training_count,
     )
 
     # 🔹 4) ALSO save a dealership-level record for dashboards (SurveyAnswer)
@@ -2716,12 +3793,13 @@ def submit_survey():
     ans = SurveyAnswer(
         dealership_id=ac.dealership_id,
         access_code_id=ac.id,
-        payload=json.dumps(payload),
+        payload=payload,
     )
 
     db.session.add(resp)
     db.session.add(ans)
     db.session.commit()
+    forget_active_code(access_code)
 
     return jsonify(ok=True, id=resp.id)
 
@@ -2763,7 +3841,11 @@ def get_subscription_status():
         if dealership_id not in accessible_dealership_ids:
             return jsonify(error="you do not have access to this dealership"), 403
 
-    dealership = Dealership.query.get(dealership_id)
+    # The authenticated user arrives with their dealership already joined in
+    if dealership_id == user.dealership_id:
+        dealership = user.dealership
+    else:
+        dealership = db.session.get(Dealership, dealership_id)
     if not dealership:
         return jsonify(error="dealership not found"), 404
 
@@ -2842,15 +3924,37 @@ def get_subscription_status():
         ok=True,
         subscription_status=dealership.subscription_status,
         subscription_plan=dealership.subscription_plan,
-        trial_ends_at=dealership.trial_ends_at.isoformat() + "Z" if dealership.trial_ends_at else None,
-        subscription_ends_at=dealership.subscription_ends_at.isoformat() + "Z" if dealership.subscription_ends_at else None,
+        trial_ends_at=iso_utc(dealership.trial_ends_at),
+        subscription_ends_at=iso_utc(dealership.subscription_ends_at),
         days_remaining_in_trial=dealership.days_remaining_in_trial(),
         is_active=dealership.is_subscription_active(),
         cancel_at_period_end=cancel_at_period_end,
     )
 
+# Process-wide cap on checkouts in flight (each makes blocking Stripe calls), so a
+# burst or slow Stripe responses can't tie up every worker thread
+STRIPE_CHECKOUT_CONCURRENCY = int(os.getenv("STRIPE_CHECKOUT_CONCURRENCY", "20"))
+_stripe_checkout_slots = threading.BoundedSemaphore(STRIPE_CHECKOUT_CONCURRENCY)
+
+def limit_concurrency(slots: threading.BoundedSemaphore, wait_seconds: float = 2, retry_after: int = 5):
+    """Run the view only if a slot frees up within wait_seconds, else 503 + Retry-After"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not slots.acquire(timeout=wait_seconds):
+                response = jsonify(error="busy", message="Too many checkouts in progress. Please try again shortly.")
+                response.headers["Retry-After"] = str(retry_after)
+                return response, 503
+            try:
+                return view(*args, **kwargs)
+            finally:
+                slots.release()
+        return wrapper
+    return decorator
+
 @app.post("/subscription/create-checkout")
 @limiter.limit("10 per minute")
+@limit_concurrency(_stripe_checkout_slots)
 def create_checkout_session():
     """
     Create Stripe checkout session for subscription.
@@ -2924,11 +4028,14 @@ def create_checkout_session():
 
     try:
         # Determine which dealership to create subscription for
+        # (looked up once here and reused below)
         dealership_id = None
+        dealership = None
         
         if user:
             if user.role == "admin":
                 dealership_id = user.dealership_id
+                dealership = user.dealership
                 # If admin doesn't have a dealership, we'll create one after checkout
             elif user.role == "corporate":
                 dealership_id = data.get("dealership_id")
@@ -2940,7 +4047,7 @@ def create_checkout_session():
                 if dealership_id not in accessible_dealership_ids:
                     return jsonify(error="you do not have access to this dealership"), 403
                 
-                dealership = Dealership.query.get(dealership_id)
+                dealership = db.session.get(Dealership, dealership_id)
                 if not dealership:
                     return jsonify(error="dealership not found"), 404
                 
@@ -2974,10 +4081,8 @@ def create_checkout_session():
                         return jsonify(error="This email is already registered. Please sign in to subscribe."), 400
         
         # If user has a dealership, use it; otherwise we'll create one in webhook
-        if dealership_id:
-            dealership = Dealership.query.get(dealership_id)
-            if not dealership:
-                dealership_id = None
+        if not dealership:
+            dealership_id = None
         
         # For new admin registration, we need to create a user account first (or use existing)
         user_id_for_checkout = None
@@ -2992,7 +4097,7 @@ def create_checkout_session():
             # This allows us to track the subscription
             temp_user = User(
                 email=email,
-                password_hash=generate_password_hash("temp"),  # Temporary, user will set real password
+                password_hash=hash_password("temp"),  # Temporary, user will set real password
                 role="manager",  # Temporary, will be upgraded to admin
                 is_verified=False,
                 is_approved=False,
@@ -3005,30 +4110,26 @@ def create_checkout_session():
         # Don't create Stripe customer yet - wait until payment is confirmed in webhook
         # Check if existing dealership has a customer_id (for resubscriptions)
         customer_id = None
-        if dealership_id:
-            dealership = Dealership.query.get(dealership_id)
-            if dealership and dealership.stripe_customer_id:
-                customer_id = dealership.stripe_customer_id
-                # Verify customer exists in Stripe
-                try:
-                    stripe.Customer.retrieve(customer_id)
-                except stripe._error.InvalidRequestError as e:
-                    # Customer doesn't exist in Stripe, clear it from database
-                    if "No such customer" in str(e):
-                        print(f"[STRIPE] Customer {customer_id} not found in Stripe, will create after payment", flush=True)
-                        customer_id = None
-                        if dealership:
-                            dealership.stripe_customer_id = None
-                            db.session.commit()
-                    else:
-                        raise
-                except Exception as e:
-                    # Other Stripe errors - log and will create after payment
-                    print(f"[STRIPE] Error retrieving customer {customer_id}: {e}, will create after payment", flush=True)
+        if dealership and dealership.stripe_customer_id:
+            customer_id = dealership.stripe_customer_id
+            # Verify customer exists in Stripe
+            try:
+                stripe.Customer.retrieve(customer_id)
+            except stripe._error.InvalidRequestError as e:
+                # Customer doesn't exist in Stripe, clear it from database
+                if "No such customer" in str(e):
+                    print(f"[STRIPE] Customer {customer_id} not found in Stripe, will create after payment", flush=True)
                     customer_id = None
-                    if dealership:
-                        dealership.stripe_customer_id = None
-                        db.session.commit()
+                    dealership.stripe_customer_id = None
+                    db.session.commit()
+                else:
+                    raise
+            except Exception as e:
+                # Other Stripe errors - log and will create after payment
+                print(f"[STRIPE] Error retrieving customer {customer_id}: {e}, will create after payment", flush=True)
+                customer_id = None
+                dealership.stripe_customer_id = None
+                db.session.commit()
 
         # Ensure email is set (should be set by now, but safety check)
         if not email and user:
@@ -3127,173 +4228,328 @@ def stripe_webhook():
     except stripe._error.SignatureVerificationError:
         return jsonify(error="Invalid signature"), 400
 
-    # Handle the event
-    if event["type"] == "checkout.session.completed":
-        session = event["data"]["object"]
-        handle_checkout_completed(session)
-    elif event["type"] == "customer.subscription.updated":
-        subscription = event["data"]["object"]
-        handle_subscription_updated(subscription)
-    elif event["type"] == "customer.subscription.deleted":
-        subscription = event["data"]["object"]
-        handle_subscription_deleted(subscription)
+    # Store the event and acknowledge right away; handlers run in the background
+    db.session.add(WebhookEvent(
+        external_id=event["id"],
+        provider="stripe",
+        type=event["type"],
+        payload=json.loads(payload),
+    ))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Stripe redelivered an event we already have
+        db.session.rollback()
+        return jsonify(ok=True, duplicate=True)
 
+    queue_webhook_processing()
     return jsonify(ok=True)
 
-def handle_checkout_completed(session):
-    """Handle successful checkout - upgrade user to admin and create/update dealership"""
-    try:
-        metadata = session.get("metadata", {})
-        user_id = metadata.get("user_id")
-        dealership_id_str = metadata.get("dealership_id")
-        user_email = metadata.get("user_email")
-        is_new_admin = metadata.get("is_new_admin", "false") == "true"
-        
-        if not user_id:
-            print(f"[WEBHOOK ERROR] No user_id in checkout session metadata", flush=True)
-            return
+WEBHOOK_BATCH_SIZE = 100
+# A batch still "processing" after this long belongs to a worker that died
+# (deploy, restart, max_requests) and is claimed again
+WEBHOOK_CLAIM_TIMEOUT = datetime.timedelta(seconds=int(os.getenv("WEBHOOK_CLAIM_TIMEOUT_SECONDS", "300")))
+WEBHOOK_SWEEP_SECONDS = int(os.getenv("WEBHOOK_SWEEP_SECONDS", "60"))
+# Stripe already got its 200, so a failed handler is retried here: back to
+# pending with exponential backoff (30s, 1m, 2m, ... capped at 1h) until the
+# attempt limit, then left as failed
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_RETRY_BASE_SECONDS = 30
+WEBHOOK_RETRY_MAX_SECONDS = 3600
+
+def webhook_retry_delay(attempts: int) -> datetime.timedelta:
+    return datetime.timedelta(seconds=min(WEBHOOK_RETRY_BASE_SECONDS * 2 ** (attempts - 1), WEBHOOK_RETRY_MAX_SECONDS))
+
+def _dispatch_webhook_event(event_type: str, obj: dict):
+    if event_type == "checkout.session.completed":
+        handle_checkout_completed(obj)
+    elif event_type == "customer.subscription.updated":
+        handle_subscription_updated(obj)
+    elif event_type == "customer.subscription.deleted":
+        handle_subscription_deleted(obj)
+
+def process_pending_webhook_events() -> int:
+    """
+    Drain stored webhook events in batches of WEBHOOK_BATCH_SIZE, oldest first.
+    Each batch is claimed in one UPDATE that also counts the attempt (pending rows
+    that are due, plus processing rows whose claim is older than
+    WEBHOOK_CLAIM_TIMEOUT), every event runs in its own SAVEPOINT (so one failure
+    only rolls back that event), and the handlers' changes and status marks for
+    the whole batch land in a single commit. Failed events go back to pending
+    with backoff until WEBHOOK_MAX_ATTEMPTS.
+    Returns the number of events handled.
+    """
+    handled = 0
+    while True:
+        now = datetime.datetime.utcnow()
+        stale = now - WEBHOOK_CLAIM_TIMEOUT
+        pending = (
+            select(WebhookEvent.id)
+            .where(or_(
+                and_(
+                    WebhookEvent.status == "pending",
+                    or_(WebhookEvent.next_attempt_at == None, WebhookEvent.next_attempt_at <= now),
+                ),
+                and_(
+                    WebhookEvent.status == "processing",
+                    or_(WebhookEvent.claimed_at == None, WebhookEvent.claimed_at < stale),
+                ),
+            ))
+            .order_by(WebhookEvent.id)
+            .limit(WEBHOOK_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        claimed = db.session.execute(
+            update(WebhookEvent)
+            .where(WebhookEvent.id.in_(pending))
+            .values(status="processing", claimed_at=now, attempts=WebhookEvent.attempts + 1)
+            .returning(WebhookEvent.id, WebhookEvent.external_id, WebhookEvent.type,
+                       WebhookEvent.payload, WebhookEvent.attempts)
+        ).all()
+        db.session.commit()
+        if not claimed:
+            return handled
+
+        processed, failed = [], []
+        for row in sorted(claimed, key=lambda r: r.id):
+            if row.attempts > WEBHOOK_MAX_ATTEMPTS:
+                # Reclaimed after its workers kept dying mid-batch; stop retrying
+                logger.error("webhook event %s abandoned after %s attempts", row.external_id, row.attempts - 1)
+                failed.append(row)
+                continue
+            try:
+                with db.session.begin_nested():
+                    _dispatch_webhook_event(row.type, row.payload["data"]["object"])
+                processed.append(row.id)
+            except Exception:
+                logger.exception("webhook event %s failed (attempt %s/%s)",
+                                 row.external_id, row.attempts, WEBHOOK_MAX_ATTEMPTS)
+                failed.append(row)
+
+        now = datetime.datetime.utcnow()
+        if processed:
+            db.session.execute(
+                update(WebhookEvent)
+                .where(WebhookEvent.id.in_(processed))
+                .values(status="processed", processed_at=now)
+            )
+        if failed:
+            db.session.execute(update(WebhookEvent), [
+                {"id": row.id, "status": "failed", "next_attempt_at": None}
+                if row.attempts >= WEBHOOK_MAX_ATTEMPTS else
+                {"id": row.id, "status": "pending", "next_attempt_at": now + webhook_retry_delay(row.attempts)}
+                for row in failed
+            ])
+        db.session.commit()
+        handled += len(claimed)
 
-        # Get the user
-        user = User.query.get(int(user_id))
-        if not user:
-            print(f"[WEBHOOK ERROR] User {user_id} not found", flush=True)
+def _process_pending_webhook_events_in_context():
+    with app.app_context():
+        try:
+            process_pending_webhook_events()
+        except Exception:
+            db.session.rollback()
+            logger.exception("webhook batch failed")
+
+# Webhook handlers run on the Celery worker when configured, else a small local pool.
+# A run drains everything pending; the sweeper below also queues one every
+# WEBHOOK_SWEEP_SECONDS so events whose task was lost (or whose worker died
+# mid-batch) are picked up without waiting for the next delivery.
+_webhook_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="webhook")
+
+if celery is not None:
+    @celery.task(name="star4ce.process_webhook_events")
+    def process_webhook_events_task():
+        _process_pending_webhook_events_in_context()
+
+def queue_webhook_processing():
+    if celery is not None:
+        return process_webhook_events_task.delay()
+    return _webhook_pool.submit(_process_pending_webhook_events_in_context)
+
+def _webhook_sweeper():
+    while True:
+        try:
+            queue_webhook_processing()
+        except Exception:
+            logger.exception("queueing webhook sweep failed")
+        time.sleep(WEBHOOK_SWEEP_SECONDS)
+
+_webhook_sweeper_started = False
+_webhook_sweeper_lock = threading.Lock()
+
+@app.before_request
+def _start_webhook_sweeper():
+    """Start the sweeper once per worker process (after any fork), draining immediately"""
+    global _webhook_sweeper_started
+    if _webhook_sweeper_started or not STRIPE_WEBHOOK_SECRET:
+        return
+    with _webhook_sweeper_lock:
+        if _webhook_sweeper_started:
             return
-        
-        # If this is a new admin registration, user should already be verified
-        # (they verified email before subscribing)
-        if is_new_admin or (user.role == "manager" and not user.dealership_id):
-            # User already verified email before subscribing, so just approve them
-            user.is_approved = True  # Auto-approve on payment (they paid)
-            if not user.approved_at:
-                user.approved_at = datetime.datetime.utcnow()
-            
-            # Ensure they're verified (should already be true, but safety check)
-            if not user.is_verified:
-                user.is_verified = True
-                print(f"[WEBHOOK] Auto-verified user {user.email} after payment (should have been verified already)", flush=True)
-            
-            db.session.commit()
-            print(f"[WEBHOOK] User {user.email} approved after payment (already verified)", flush=True)
+        _webhook_sweeper_started = True
+    threading.Thread(target=_webhook_sweeper, name="webhook-sweeper", daemon=True).start()
 
-        # Create or get dealership
-        dealership = None
-        if dealership_id_str and dealership_id_str != "new":
-            dealership = Dealership.query.get(int(dealership_id_str))
+def handle_checkout_completed(session):
+    """Handle successful checkout - upgrade user to admin and create/update dealership"""
+    metadata = session.get("metadata", {})
+    user_id = metadata.get("user_id")
+    dealership_id_str = metadata.get("dealership_id")
+    user_email = metadata.get("user_email")
+    is_new_admin = metadata.get("is_new_admin", "false") == "true"
+    
+    if not user_id:
+        print(f"[WEBHOOK ERROR] No user_id in checkout session metadata", flush=True)
+        return
+
+    # Get the user (just the columns we read; the row is written with one UPDATE below)
+    user = db.session.query(
+        User.id, User.email, User.full_name, User.role, User.dealership_id, User.is_verified, User.approved_at
+    ).filter_by(id=int(user_id)).first()
+    if not user:
+        print(f"[WEBHOOK ERROR] User {user_id} not found", flush=True)
+        return
+    user_values = {}
+    
+    # If this is a new admin registration, user should already be verified
+    # (they verified email before subscribing)
+    if is_new_admin or (user.role == "manager" and not user.dealership_id):
+        # User already verified email before subscribing, so just approve them
+        user_values["is_approved"] = True  # Auto-approve on payment (they paid)
+        if not user.approved_at:
+            user_values["approved_at"] = datetime.datetime.utcnow()
         
-        # Also check if user already has a dealership (for resubscriptions)
-        if not dealership and user.dealership_id:
-            dealership = Dealership.query.get(user.dealership_id)
+        # Ensure they're verified (should already be true, but safety check)
+        if not user.is_verified:
+            user_values["is_verified"] = True
+            print(f"[WEBHOOK] Auto-verified user {user.email} after payment (should have been verified already)", flush=True)
         
-        if not dealership:
-            # Create new dealership for this user
-            # Get dealership info from metadata if provided
-            dealership_name = metadata.get("dealership_name", "").strip() or f"{user.full_name or user.email}'s Dealership"
-            dealership_address = metadata.get("dealership_address", "").strip() or None
-            dealership_city = metadata.get("dealership_city", "").strip() or None
-            dealership_state = metadata.get("dealership_state", "").strip() or None
-            dealership_zip_code = metadata.get("dealership_zip_code", "").strip() or None
-            
-            dealership = Dealership(
-                name=dealership_name,
-                address=dealership_address,
-                city=dealership_city,
-                state=dealership_state,
-                zip_code=dealership_zip_code,
-                subscription_status="active",
-                subscription_plan="pro",
-                trial_ends_at=None,  # No trial, they paid
-            )
-            db.session.add(dealership)
-            db.session.flush()  # Get the ID
+        print(f"[WEBHOOK] User {user.email} approved after payment (already verified)", flush=True)
+
+    # Create or get dealership
+    dealership = None
+    if dealership_id_str and dealership_id_str != "new":
+        dealership = Dealership.query.get(int(dealership_id_str))
+    
+    # Also check if user already has a dealership (for resubscriptions)
+    if not dealership and user.dealership_id:
+        dealership = Dealership.query.get(user.dealership_id)
+    
+    if not dealership:
+        # Create new dealership for this user
+        # Get dealership info from metadata if provided
+        dealership_name = metadata.get("dealership_name", "").strip() or f"{user.full_name or user.email}'s Dealership"
+        dealership_address = metadata.get("dealership_address", "").strip() or None
+        dealership_city = metadata.get("dealership_city", "").strip() or None
+        dealership_state = metadata.get("dealership_state", "").strip() or None
+        dealership_zip_code = metadata.get("dealership_zip_code", "").strip() or None
         
-        # Update dealership subscription info (important for resubscriptions)
-        subscription_id = session.get("subscription")
-        if subscription_id:
-            dealership.stripe_subscription_id = subscription_id
-            dealership.subscription_status = "active"  # Always set to active on new payment
-            dealership.subscription_plan = "pro"
-            # Get actual period end from Stripe subscription if available
-            try:
-                sub = stripe.Subscription.retrieve(subscription_id)
-                period_end = sub.get("current_period_end")
-                if period_end:
-                    dealership.subscription_ends_at = datetime.datetime.fromtimestamp(period_end)
-                else:
-                    # Fallback: 1 month from now
-                    dealership.subscription_ends_at = datetime.datetime.utcnow() + datetime.timedelta(days=30)
-            except:
-                # Fallback: 1 month from now if we can't retrieve from Stripe
+        dealership = Dealership(
+            name=dealership_name,
+            address=dealership_address,
+            city=dealership_city,
+            state=dealership_state,
+            zip_code=dealership_zip_code,
+            subscription_status="active",
+            subscription_plan="pro",
+            trial_ends_at=None,  # No trial, they paid
+        )
+        db.session.add(dealership)
+        db.session.flush()  # Get the ID
+    
+    # Update dealership subscription info (important for resubscriptions)
+    subscription_id = session.get("subscription")
+    if subscription_id:
+        dealership.stripe_subscription_id = subscription_id
+        dealership.subscription_status = "active"  # Always set to active on new payment
+        dealership.subscription_plan = "pro"
+        # Get actual period end from Stripe subscription if available
+        try:
+            sub = stripe.Subscription.retrieve(subscription_id)
+            period_end = sub.get("current_period_end")
+            if period_end:
+                dealership.subscription_ends_at = datetime.datetime.fromtimestamp(period_end)
+            else:
+                # Fallback: 1 month from now
                 dealership.subscription_ends_at = datetime.datetime.utcnow() + datetime.timedelta(days=30)
-        
-        # Get or create Stripe customer - create it now that payment is confirmed
-        customer_id = session.get("customer")
-        if not customer_id:
-            # Customer wasn't created yet - create it now after payment
-            try:
+        except:
+            # Fallback: 1 month from now if we can't retrieve from Stripe
+            dealership.subscription_ends_at = datetime.datetime.utcnow() + datetime.timedelta(days=30)
+    
+    # Get or create Stripe customer - create it now that payment is confirmed
+    customer_id = session.get("customer")
+    if not customer_id:
+        # Customer wasn't created yet - reuse one from an earlier checkout by this
+        # email, else create it now after payment. The idempotency key makes a
+        # reprocessed event get the same customer back instead of a duplicate.
+        try:
+            existing = stripe.Customer.search(query=f"email:'{user.email}'", limit=1)
+            if existing.data:
+                customer_id = existing.data[0].id
+                print(f"[WEBHOOK] Reusing Stripe customer {customer_id} for user {user.email}", flush=True)
+            else:
                 customer = stripe.Customer.create(
                     email=user.email,
                     metadata={
                         "user_id": str(user.id),
                         "dealership_id": str(dealership.id)
-                    }
+                    },
+                    idempotency_key=f"customer-user-{user.id}",
                 )
                 customer_id = customer.id
                 print(f"[WEBHOOK] Created Stripe customer {customer_id} for user {user.email} after payment", flush=True)
-            except Exception as e:
-                print(f"[WEBHOOK ERROR] Failed to create Stripe customer: {e}", flush=True)
-                # Continue without customer_id - subscription will still work
-        
-        # Save customer ID to dealership
-        if customer_id:
-            dealership.stripe_customer_id = customer_id
+        except Exception as e:
+            print(f"[WEBHOOK ERROR] Failed to create Stripe customer: {e}", flush=True)
+            # Continue without customer_id - subscription will still work
+    
+    # Save customer ID to dealership
+    if customer_id:
+        dealership.stripe_customer_id = customer_id
 
-        # Upgrade user to admin and assign to dealership
-        user.role = "admin"
-        user.dealership_id = dealership.id
+    # Upgrade user to admin and assign to dealership
+    user_values.update(role="admin", dealership_id=dealership.id)
+    db.session.execute(update(User).where(User.id == user.id).values(**user_values))
+    # Bulk UPDATEs skip the after_flush hook; queue the cache drop for after commit
+    db.session.info.setdefault("_dirty_users", set()).add(user.email)
+    print(f"[WEBHOOK SUCCESS] User {user.email} upgraded to admin, dealership {dealership.id} created/updated", flush=True)
 
-        db.session.commit()
-        print(f"[WEBHOOK SUCCESS] User {user.email} upgraded to admin, dealership {dealership.id} created/updated", flush=True)
-    except Exception as e:
-        print(f"[WEBHOOK ERROR] Checkout completed handler failed: {e}", flush=True)
-        import traceback
-        traceback.print_exc()
+def _update_dealership_by_customer(customer_id: str, values: dict):
+    """
+    Single UPDATE ... RETURNING on the dealership with this Stripe customer
+    (updated_at is filled in by the column's onupdate). The returned ids are
+    queued so the subscription cache is dropped after commit, as the session
+    hooks do for ORM writes.
+    """
+    updated = db.session.execute(
+        update(Dealership)
+        .where(Dealership.stripe_customer_id == customer_id)
+        .values(**values)
+        .returning(Dealership.id)
+    ).scalars().all()
+    db.session.info.setdefault("_dirty_dealerships", set()).update(updated)
 
 def handle_subscription_updated(subscription):
     """Handle subscription updates"""
-    try:
-        customer_id = subscription.get("customer")
-        dealership = Dealership.query.filter_by(stripe_customer_id=customer_id).first()
-        if not dealership:
-            return
-
-        status = subscription.get("status")
-        dealership.subscription_status = status
-        dealership.stripe_subscription_id = subscription.get("id")
+    values = {
+        "subscription_status": subscription.get("status"),
+        "stripe_subscription_id": subscription.get("id"),
+    }
 
-        # Update subscription end date
-        current_period_end = subscription.get("current_period_end")
-        if current_period_end:
-            dealership.subscription_ends_at = datetime.datetime.fromtimestamp(current_period_end)
+    # Update subscription end date
+    current_period_end = subscription.get("current_period_end")
+    if current_period_end:
+        values["subscription_ends_at"] = datetime.datetime.fromtimestamp(current_period_end)
 
-        db.session.commit()
-    except Exception as e:
-        print(f"[WEBHOOK ERROR] Subscription updated handler failed: {e}", flush=True)
+    _update_dealership_by_customer(subscription.get("customer"), values)
 
 def handle_subscription_deleted(subscription):
     """Handle subscription cancellation"""
-    try:
-        customer_id = subscription.get("customer")
-        dealership = Dealership.query.filter_by(stripe_customer_id=customer_id).first()
-        if not dealership:
-            return
-
-        dealership.subscription_status = "canceled"
-        dealership.subscription_ends_at = datetime.datetime.fromtimestamp(
+    _update_dealership_by_customer(subscription.get("customer"), {
+        "subscription_status": "canceled",
+        "subscription_ends_at": datetime.datetime.fromtimestamp(
             subscription.get("current_period_end", datetime.datetime.utcnow().timestamp())
-        )
-        db.session.commit()
-    except Exception as e:
-        print(f"[WEBHOOK ERROR] Subscription deleted handler failed: {e}", flush=True)
+        ),
+    })
 
 @app.post("/subscription/cancel")
 @limiter.limit("5 per hour")
@@ -3507,8 +4763,8 @@ def get_corporate_subscriptions():
             "dealership_name": dealership.name,
             "subscription_status": dealership.subscription_status,
             "subscription_plan": dealership.subscription_plan,
-            "trial_ends_at": dealership.trial_ends_at.isoformat() + "Z" if dealership.trial_ends_at else None,
-            "subscription_ends_at": dealership.subscription_ends_at.isoformat() + "Z" if dealership.subscription_ends_at else None,
+            "trial_ends_at": iso_utc(dealership.trial_ends_at),
+            "subscription_ends_at": iso_utc(dealership.subscription_ends_at),
             "days_remaining_in_trial": dealership.days_remaining_in_trial(),
             "is_active": dealership.is_subscription_active(),
             "cancel_at_period_end": cancel_at_period_end,
@@ -3597,6 +4853,7 @@ def promote_manager_to_admin(manager_id: int):
         manager.approved_by = user.id
     
     db.session.commit()
+    invalidate_user_cache([manager.email])
     
     # Log admin action
     log_admin_action(
@@ -3604,7 +4861,7 @@ def promote_manager_to_admin(manager_id: int):
         "promote_manager_to_admin",
         "user",
         manager.id,
-        json.dumps({"manager_email": manager.email, "dealership_id": dealership_id})
+        {"manager_email": manager.email, "dealership_id": dealership_id}
     )
     
     return jsonify(ok=True, message=f"Manager '{manager.email}' promoted to admin successfully")
@@ -3626,14 +4883,13 @@ def check_subscription_limits():
             message="No subscription limits for accounts without dealership"
         )
 
-    dealership = Dealership.query.get(user.dealership_id)
-    if not dealership:
+    # Served from the subscription cache (dropped whenever the dealership is written)
+    state = _subscription_state(user.dealership_id)
+    if state is None:
         return jsonify(error="dealership not found"), 404
 
-    is_active = dealership.is_subscription_active()
-
     # Define limits based on subscription status
-    if not is_active:
+    if not subscription_active(user.dealership_id):
         return jsonify(
             ok=True,
             can_create_employees=False,
@@ -3648,8 +4904,8 @@ def check_subscription_limits():
         can_create_employees=True,
         can_create_access_codes=True,
         can_view_analytics=True,
-        subscription_status=dealership.subscription_status,
-        days_remaining=dealership.days_remaining_in_trial() if dealership.subscription_status == "trial" else None,
+        subscription_status=state[0],
+        days_remaining=trial_days_remaining(state) if state[0] == "trial" else None,
     )
 
 # ===== CORPORATE DEALERSHIP MANAGEMENT ENDPOINTS =====
@@ -3741,7 +4997,7 @@ def get_admin_managers():
     approved_managers = [m for m in all_managers if m.is_approved]
     
     # Get permissions for each manager
-    permission_keys = list(DEFAULT_PERMISSIONS["admin"].keys())
+    permission_keys = PERMISSION_KEYS
     
     def get_manager_with_permissions(manager):
         manager_dict = manager.to_dict()
@@ -3833,14 +5089,13 @@ def create_manager():
         return jsonify(error="this email is already registered"), 400
     
     # Generate verification code
-    code_int = secrets.randbelow(1_000_000)
-    verification_code = f"{code_int:06d}"
+    verification_code = generate_six_digit_code()
     expires_at = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
     
     # Create manager account (auto-verified, but needs approval)
     manager = User(
         email=email,
-        password_hash=generate_password_hash(password),
+        password_hash=hash_password(password),
         role="manager",
         dealership_id=user.dealership_id,
         is_verified=True,  # Auto-verify for admin-created managers
@@ -3857,7 +5112,7 @@ def create_manager():
         "create_manager",
         "user",
         manager.id,
-        json.dumps({"manager_email": manager.email, "dealership_id": user.dealership_id})
+        {"manager_email": manager.email, "dealership_id": user.dealership_id}
     )
     
     return jsonify(ok=True, manager=manager.to_dict(), message=f"Manager account created for '{manager.email}' successfully")
@@ -3891,6 +5146,7 @@ def approve_manager(manager_id: int):
     manager.approved_at = datetime.datetime.utcnow()
     manager.approved_by = user.id
     db.session.commit()
+    invalidate_user_cache([manager.email])
     
     # Log admin action
     log_admin_action(
@@ -3898,7 +5154,7 @@ def approve_manager(manager_id: int):
         "approve_manager",
         "user",
         manager_id,
-        json.dumps({"manager_email": manager.email})
+        {"manager_email": manager.email}
     )
     
     return jsonify(ok=True, message=f"Manager '{manager.email}' approved successfully")
@@ -3935,6 +5191,7 @@ def reject_manager(manager_id: int):
     # Delete the manager account
     db.session.delete(manager)
     db.session.commit()
+    invalidate_user_cache([manager_email])
     
     # Log admin action
     log_admin_action(
@@ -3942,7 +5199,7 @@ def reject_manager(manager_id: int):
         "reject_manager",
         "user",
         manager_id,
-        json.dumps({"manager_email": manager_email})
+        {"manager_email": manager_email}
     )
     
     return jsonify(ok=True, message=f"Manager '{manager_email}' rejected and removed")
@@ -3986,7 +5243,7 @@ def admin_assign_dealership_to_corporate(corporate_user_id: int, dealership_id:
         "assign_dealership_to_corporate",
         "dealership",
         dealership_id,
-        json.dumps({"corporate_user_email": corporate_user.email, "dealership_name": dealership.name})
+        {"corporate_user_email": corporate_user.email, "dealership_name": dealership.name}
     )
     
     return jsonify(ok=True, message=f"Dealership '{dealership.name}' assigned to '{corporate_user.email}' successfully")
@@ -4030,7 +5287,7 @@ def admin_unassign_dealership_from_corporate(corporate_user_id: int, dealership_
         "unassign_dealership_from_corporate",
         "dealership",
         dealership_id,
-        json.dumps({"corporate_user_email": corporate_user.email, "dealership_name": dealership.name})
+        {"corporate_user_email": corporate_user.email, "dealership_name": dealership.name}
     )
     
     return jsonify(ok=True, message=f"Dealership '{dealership.name}' unassigned from '{corporate_user.email}' successfully")
@@ -4118,7 +5375,7 @@ def create_dealership():
         "create_dealership",
         "dealership",
         dealership.id,
-        json.dumps({"dealership_name": dealership.name})
+        {"dealership_name": dealership.name}
     )
     
     return jsonify(ok=True, dealership=dealership.to_dict(), message=f"Dealership '{dealership.name}' created successfully")
@@ -4172,7 +5429,7 @@ def create_admin_for_dealership(dealership_id: int):
     # Create admin account (auto-verified and approved)
     admin_user = User(
         email=email,
-        password_hash=generate_password_hash(password),
+        password_hash=hash_password(password),
         role="admin",
         is_verified=True,  # Auto-verify for corporate-created admins
         is_approved=True,  # Auto-approve
@@ -4187,7 +5444,7 @@ def create_admin_for_dealership(dealership_id: int):
         "create_admin",
         "user",
         admin_user.id,
-        json.dumps({"admin_email": admin_user.email, "dealership_id": dealership_id, "dealership_name": dealership.name})
+        {"admin_email": admin_user.email, "dealership_id": dealership_id, "dealership_name": dealership.name}
     )
     
     return jsonify(ok=True, admin=admin_user.to_dict(), message=f"Admin account created for '{dealership.name}' successfully")
@@ -4320,6 +5577,7 @@ def approve_admin_request(request_id: int):
     admin_request.reviewed_by = user.id
     
     db.session.commit()
+    invalidate_user_cache([manager.email])
     
     # Log admin action
     log_admin_action(
@@ -4327,7 +5585,7 @@ def approve_admin_request(request_id: int):
         "approve_admin_request",
         "user",
         manager.id,
-        json.dumps({"manager_email": manager.email, "dealership_id": admin_request.dealership_id})
+        {"manager_email": manager.email, "dealership_id": admin_request.dealership_id}
     )
     
     return jsonify(ok=True, message=f"Admin request approved. '{manager.email}' is now admin for this dealership")
@@ -4488,11 +5746,11 @@ def approve_dealership_access_request(request_id: int):
         "approve_dealership_access_request",
         "dealership_access_request",
         request_id,
-        json.dumps({
+        {
             "corporate_user_email": corporate_user.email,
             "dealership_id": dealership.id,
             "dealership_name": dealership.name
-        })
+        }
     )
     
     return jsonify(
@@ -4539,11 +5797,11 @@ def reject_dealership_access_request(request_id: int):
         "reject_dealership_access_request",
         "dealership_access_request",
         request_id,
-        json.dumps({
+        {
             "corporate_user_email": access_request.corporate_user.email if access_request.corporate_user else None,
             "dealership_id": access_request.dealership_id,
             "notes": notes
-        })
+        }
     )
     
     return jsonify(ok=True, message="Access request rejected")
@@ -4596,6 +5854,73 @@ DEFAULT_PERMISSIONS = {
     },
 }
 
+# Precomputed once at import: every permission key, and each role's defaults
+# packed into an int bitmask (bit i set = PERMISSION_KEYS[i] allowed by default)
+PERMISSION_KEYS = tuple(DEFAULT_PERMISSIONS["admin"].keys())
+PERMISSION_INDEX = {key: i for i, key in enumerate(PERMISSION_KEYS)}
+ROLE_MASK = {
+    role: sum(1 << PERMISSION_INDEX[key] for key, allowed in perms.items() if allowed)
+    for role, perms in DEFAULT_PERMISSIONS.items()
+}
+
+def default_permission(role: str, permission_key: str) -> bool:
+    """Default (no DB override) permission for a role"""
+    bit = PERMISSION_INDEX.get(permission_key)
+    if bit is None:
+        return False
+    return bool((ROLE_MASK.get(role, 0) >> bit) & 1)
+
+def default_permissions(role: str) -> dict:
+    """All default permissions for a role, unpacked from its mask in one pass"""
+    mask = ROLE_MASK.get(role, 0)
+    return {key: bool((mask >> i) & 1) for i, key in enumerate(PERMISSION_KEYS)}
+
+def _request_perm_cache() -> dict:
+    """Per-request memo for permission checks (dropped in teardown)"""
+    cache = getattr(g, "_perm_cache", None)
+    if cache is None:
+        cache = g._perm_cache = {}
+    return cache
+
+@app.teardown_request
+def _drop_perm_cache(exc=None):
+    g.pop("_perm_cache", None)
+
+# Process-wide cache of role permission lookups: (role, key) -> (allowed, expires_at).
+# Role permissions only change via /admin/permissions, which clears this cache;
+# the TTL bounds staleness in other worker processes.
+ROLE_PERMISSION_CACHE_TTL = int(os.getenv("ROLE_PERMISSION_CACHE_TTL", "300"))
+_role_perm_cache = {}
+_role_perm_map_cache = {}  # role -> (frozen permission map, expires_at)
+_role_perm_version = 0
+
+def invalidate_role_permission_cache():
+    """Drop cached role permissions after a write"""
+    global _role_perm_version
+    _role_perm_cache.clear()
+    _role_perm_map_cache.clear()
+    _role_perm_version += 1
+
+def role_permission_map(role: str):
+    """
+    Read-only map of every permission for a role: defaults overlaid with the
+    role's DB overrides, loaded in one query and cached like get_permission.
+    """
+    now = time.monotonic()
+    cached = _role_perm_map_cache.get(role)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    
+    merged = default_permissions(role)
+    merged.update(
+        db.session.query(RolePermission.permission_key, RolePermission.allowed)
+        .filter_by(role=role)
+        .all()
+    )
+    frozen = types.MappingProxyType(merged)
+    _role_perm_map_cache[role] = (frozen, now + ROLE_PERMISSION_CACHE_TTL)
+    return frozen
+
 def get_permission(role: str, permission_key: str) -> bool:
     """
     Check if a role has a specific permission.
@@ -4604,14 +5929,29 @@ def get_permission(role: str, permission_key: str) -> bool:
     """
     if role == "admin":
         return True  # Admin always has all permissions
-    
-    # Check database first
-    perm = RolePermission.query.filter_by(role=role, permission_key=permission_key).first()
-    if perm:
-        return perm.allowed
-    
-    # Fall back to defaults
-    return DEFAULT_PERMISSIONS.get(role, {}).get(permission_key, False)
+
+    cache = _request_perm_cache()
+    cache_key = (None, role, permission_key)
+    if cache_key in cache:
+        return cache[cache_key]
+
+    now = time.monotonic()
+    cached = _role_perm_cache.get((role, permission_key))
+    if cached is not None and cached[1] > now:
+        cache[cache_key] = cached[0]
+        return cached[0]
+
+    # Check database first (only the allowed flag, no ORM object)
+    allowed = db.session.query(RolePermission.allowed).filter_by(
+        role=role, permission_key=permission_key
+    ).scalar()
+    if allowed is None:
+        # Fall back to defaults
+        allowed = default_permission(role, permission_key)
+
+    _role_perm_cache[(role, permission_key)] = (allowed, now + ROLE_PERMISSION_CACHE_TTL)
+    cache[cache_key] = allowed
+    return allowed
 
 def has_permission(user, permission_key: str) -> bool:
     """
@@ -4623,22 +5963,87 @@ def has_permission(user, permission_key: str) -> bool:
     """
     if user.role == "admin":
         return True  # Admin always has all permissions
-    
+
     # For corporate users, only use role-based permissions
     if user.role == "corporate":
-        return get_permission(user.role, permission_key)
-    
+        return role_permission_map("corporate").get(permission_key, False)
+
     # For managers, check user-specific permissions first
     if user.role == "manager":
-        user_perm = UserPermission.query.filter_by(user_id=user.id, permission_key=permission_key).first()
-        if user_perm is not None:
-            return user_perm.allowed
-        # Fall back to role-based permissions
-        return get_permission(user.role, permission_key)
-    
+        cache = _request_perm_cache()
+        cache_key = (user.id, user.role, permission_key)
+        if cache_key in cache:
+            return cache[cache_key]
+        allowed = db.session.query(UserPermission.allowed).filter_by(
+            user_id=user.id, permission_key=permission_key
+        ).scalar()
+        if allowed is None:
+            # Fall back to role-based permissions
+            allowed = get_permission(user.role, permission_key)
+        cache[cache_key] = allowed
+        return allowed
+
     # Default fallback
     return get_permission(user.role, permission_key)
 
+def upsert_permission(model, conflict_columns: list, **values) -> int:
+    """
+    Insert or update a permission row in a single atomic statement.
+    Uses INSERT ... ON CONFLICT DO UPDATE (PostgreSQL and SQLite 3.24+).
+    Returns the row id.
+    """
+    insert = pg_insert if DB_DIALECT == "postgresql" else sqlite_insert
+    stmt = insert(model).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=conflict_columns,
+        set_={"allowed": stmt.excluded.allowed, "updated_at": datetime.datetime.utcnow()},
+    ).returning(model.id)
+    return db.session.execute(stmt).scalar()
+
+def bulk_permissions(user) -> dict:
+    """
+    Resolve every permission key for a user in at most two queries.
+    Same priority as has_permission: admin > user-specific > role-based > defaults.
+    """
+    return _resolve_permissions(user.id, user.role)
+
+def _resolve_permissions(user_id: int, role: str) -> dict:
+    if role == "admin":
+        return {key: True for key in PERMISSION_KEYS}
+
+    # User-specific overrides only apply to managers
+    user_map = {}
+    if role == "manager":
+        user_map = {
+            p.permission_key: p.allowed
+            for p in UserPermission.query.filter_by(user_id=user_id).all()
+        }
+    role_map = {
+        p.permission_key: p.allowed
+        for p in RolePermission.query.filter_by(role=role).all()
+    }
+    defaults = default_permissions(role)
+    return {
+        key: user_map.get(key, role_map.get(key, defaults.get(key, False)))
+        for key in PERMISSION_KEYS
+    }
+
+# Bumped whenever a manager's own permissions change (see invalidate_user_permission_cache)
+_user_perm_versions = {}
+
+def invalidate_user_permission_cache(user_id: int):
+    """Force /auth/permissions to be re-rendered for this user"""
+    _user_perm_versions[user_id] = _user_perm_versions.get(user_id, 0) + 1
+
+@functools.lru_cache(maxsize=4096)
+def _render_user_permissions(user_id: int, role: str, role_version: int, user_version: int, ttl_bucket: int):
+    """
+    Pre-serialized /auth/permissions body. The version arguments only exist to
+    key the cache; ttl_bucket expires entries so writes made by other worker
+    processes are picked up within ROLE_PERMISSION_CACHE_TTL.
+    """
+    return dumps_json({"ok": True, "permissions": _resolve_permissions(user_id, role), "role": role})
+
 @app.get("/admin/permissions")
 @limiter.limit("30 per minute")
 def get_role_permissions():
@@ -4653,29 +6058,30 @@ def get_role_permissions():
     if user.role != "admin":
         return jsonify(error="only admins can view permissions"), 403
     
-    # Get all permissions from database
-    all_permissions = RolePermission.query.all()
-    
     # Build permission matrix
     roles = ["manager", "corporate", "admin"]
-    permission_keys = list(DEFAULT_PERMISSIONS["admin"].keys())
+    permission_keys = PERMISSION_KEYS
+    
+    # Fetch every stored override in one query
+    rows = db.session.query(
+        RolePermission.role, RolePermission.permission_key, RolePermission.allowed
+    ).filter(
+        RolePermission.role.in_(roles),
+        RolePermission.permission_key.in_(permission_keys),
+    ).all()
+    stored = {(role, key): allowed for role, key, allowed in rows}
     
     matrix = {}
     for role in roles:
-        matrix[role] = {}
-        for key in permission_keys:
-            perm = RolePermission.query.filter_by(role=role, permission_key=key).first()
-            if perm:
-                matrix[role][key] = perm.allowed
-            else:
-                # Use default
-                matrix[role][key] = DEFAULT_PERMISSIONS.get(role, {}).get(key, False)
+        defaults = default_permissions(role)
+        # Use default when no override is stored
+        matrix[role] = {key: stored.get((role, key), defaults.get(key, False)) for key in permission_keys}
     
     return jsonify(
         ok=True,
         permissions=matrix,
         roles=roles,
-        permission_keys=permission_keys
+        permission_keys=permission_keys,
     )
 
 @app.post("/admin/permissions")
@@ -4703,31 +6109,33 @@ def update_role_permissions():
     if role == "admin":
         return jsonify(error="cannot modify admin permissions"), 400
     
-    # Find or create permission
-    perm = RolePermission.query.filter_by(role=role, permission_key=permission_key).first()
-    if perm:
-        perm.allowed = allowed
-        perm.updated_at = datetime.datetime.utcnow()
-    else:
-        perm = RolePermission(
-            role=role,
-            permission_key=permission_key,
-            allowed=allowed
-        )
-        db.session.add(perm)
-    
+    # Create or update permission in one statement
+    perm_id = upsert_permission(
+        RolePermission,
+        ["role", "permission_key"],
+        role=role,
+        permission_key=permission_key,
+        allowed=allowed,
+    )
     db.session.commit()
+    invalidate_role_permission_cache()
     
     # Log admin action
     log_admin_action(
         user.email,
         "update_permission",
         "permission",
-        perm.id,
-        json.dumps({"role": role, "permission_key": permission_key, "allowed": allowed})
+        perm_id,
+        {"role": role, "permission_key": permission_key, "allowed": allowed}
     )
     
-    return jsonify(ok=True, permission=perm.to_dict(), message="Permission updated successfully")
+    permission = {
+        "id": perm_id,
+        "role": role,
+        "permission_key": permission_key,
+        "allowed": allowed,
+    }
+    return jsonify(ok=True, permission=permission, message="Permission updated successfully")
 
 @app.get("/auth/permissions")
 @limiter.limit("30 per minute")
@@ -4740,13 +6148,15 @@ def get_user_permissions():
     if err:
         return err
     
-    # Build permissions object for this user
-    permission_keys = list(DEFAULT_PERMISSIONS["admin"].keys())
-    permissions = {}
-    for key in permission_keys:
-        permissions[key] = has_permission(user, key)
-    
-    return jsonify(ok=True, permissions=permissions, role=user.role)
+    # Serve the cached body; it is re-rendered when this user's or the role's permissions change
+    body = _render_user_permissions(
+        user.id,
+        user.role,
+        _role_perm_version,
+        _user_perm_versions.get(user.id, 0),
+        int(time.monotonic() // max(ROLE_PERMISSION_CACHE_TTL, 1)),
+    )
+    return Response(body, mimetype="application/json")
 
 @app.get("/admin/managers/<int:manager_id>/permissions")
 @limiter.limit("30 per minute")
@@ -4762,7 +6172,7 @@ def get_manager_permissions(manager_id: int):
     if user.role != "admin":
         return jsonify(error="only admins can access this endpoint"), 403
     
-    manager = User.query.get(manager_id)
+    manager = db.session.get(User, manager_id)
     if not manager:
         return jsonify(error="manager not found"), 404
     
@@ -4775,7 +6185,7 @@ def get_manager_permissions(manager_id: int):
     
     # Get user-specific permissions
     user_perms = UserPermission.query.filter_by(user_id=manager_id).all()
-    permission_keys = list(DEFAULT_PERMISSIONS["admin"].keys())
+    permission_keys = PERMISSION_KEYS
     
     permissions = {}
     for key in permission_keys:
@@ -4791,7 +6201,7 @@ def get_manager_permissions(manager_id: int):
         permissions=permissions,
         permission_keys=permission_keys,
         manager_id=manager_id,
-        manager_email=manager.email
+        manager_email=manager.email,
     )
 
 @app.post("/admin/managers/<int:manager_id>/permissions")
@@ -4808,7 +6218,7 @@ def update_manager_permission(manager_id: int):
     if user.role != "admin":
         return jsonify(error="only admins can update permissions"), 403
     
-    manager = User.query.get(manager_id)
+    manager = db.session.get(User, manager_id)
     if not manager:
         return jsonify(error="manager not found"), 404
     
@@ -4826,31 +6236,33 @@ def update_manager_permission(manager_id: int):
     if not permission_key:
         return jsonify(error="permission_key is required"), 400
     
-    # Find or create permission
-    perm = UserPermission.query.filter_by(user_id=manager_id, permission_key=permission_key).first()
-    if perm:
-        perm.allowed = allowed
-        perm.updated_at = datetime.datetime.utcnow()
-    else:
-        perm = UserPermission(
-            user_id=manager_id,
-            permission_key=permission_key,
-            allowed=allowed
-        )
-        db.session.add(perm)
-    
+    # Create or update permission in one statement
+    perm_id = upsert_permission(
+        UserPermission,
+        ["user_id", "permission_key"],
+        user_id=manager_id,
+        permission_key=permission_key,
+        allowed=allowed,
+    )
     db.session.commit()
+    invalidate_user_permission_cache(manager_id)
     
     # Log admin action
     log_admin_action(
         user.email,
         "update_manager_permission",
         "permission",
-        perm.id,
-        json.dumps({"manager_id": manager_id, "manager_email": manager.email, "permission_key": permission_key, "allowed": allowed})
+        perm_id,
+        {"manager_id": manager_id, "manager_email": manager.email, "permission_key": permission_key, "allowed": allowed}
     )
     
-    return jsonify(ok=True, permission=perm.to_dict(), message="Permission updated successfully")
+    permission = {
+        "id": perm_id,
+        "user_id": manager_id,
+        "permission_key": permission_key,
+        "allowed": allowed,
+    }
+    return jsonify(ok=True, permission=permission, message="Permission updated successfully")
 
 @app.delete("/admin/managers/<int:manager_id>/permissions/<permission_key>")
 @limiter.limit("20 per minute")
@@ -4866,34 +6278,38 @@ def delete_manager_permission(manager_id: int, permission_key: str):
     if user.role != "admin":
         return jsonify(error="only admins can delete permissions"), 403
     
-    manager = User.query.get(manager_id)
-    if not manager:
-        return jsonify(error="manager not found"), 404
-    
-    if manager.role != "manager":
-        return jsonify(error="user is not a manager"), 400
-    
-    # Verify manager belongs to admin's dealership
-    if manager.dealership_id != user.dealership_id:
-        return jsonify(error="manager does not belong to your dealership"), 403
-    
-    perm = UserPermission.query.filter_by(user_id=manager_id, permission_key=permission_key).first()
-    if perm:
-        db.session.delete(perm)
-        db.session.commit()
-        
-        # Log admin action
-        log_admin_action(
-            user.email,
-            "delete_manager_permission",
-            "permission",
-            manager_id,
-            json.dumps({"manager_id": manager_id, "manager_email": manager.email, "permission_key": permission_key})
+    # One probe covers existence, role, and dealership ownership
+    manager_email = db.session.query(User.email).filter_by(
+        id=manager_id,
+        role="manager",
+        dealership_id=user.dealership_id,
+    ).scalar()
+    if not manager_email:
+        return jsonify(error="manager not found in your dealership"), 404
+    
+    # Delete directly; the row count tells us whether it existed
+    result = db.session.execute(
+        delete(UserPermission).where(
+            UserPermission.user_id == manager_id,
+            UserPermission.permission_key == permission_key,
         )
-        
-        return jsonify(ok=True, message="Permission deleted, will use role-based permission")
+    )
+    if not result.rowcount:
+        db.session.rollback()
+        return jsonify(error="permission not found"), 404
+    db.session.commit()
+    invalidate_user_permission_cache(manager_id)
+    
+    # Log admin action
+    log_admin_action(
+        user.email,
+        "delete_manager_permission",
+        "permission",
+        manager_id,
+        {"manager_id": manager_id, "manager_email": manager_email, "permission_key": permission_key}
+    )
     
-    return jsonify(error="permission not found"), 404
+    return jsonify(ok=True, message="Permission deleted, will use role-based permission")
 
 @app.post("/corporate/admin-requests/<int:request_id>/reject")
 @limiter.limit("20 per minute")
@@ -4909,7 +6325,8 @@ def reject_admin_request(request_id: int):
     if user.role != "corporate":
         return jsonify(error="only corporate users can reject admin requests"), 403
     
-    admin_request = AdminRequest.query.get(request_id)
+    # Load the requesting user in the same query (needed for the audit log)
+    admin_request = db.session.get(AdminRequest, request_id, options=[joinedload(AdminRequest.user)])
     if not admin_request:
         return jsonify(error="admin request not found"), 404
     
@@ -4938,7 +6355,7 @@ def reject_admin_request(request_id: int):
         "reject_admin_request",
         "user",
         admin_request.user_id,
-        json.dumps({"manager_email": admin_request.user.email, "dealership_id": admin_request.dealership_id, "notes": notes})
+        {"manager_email": admin_request.user.email, "dealership_id": admin_request.dealership_id, "notes": notes}
     )
     
     return jsonify(ok=True, message="Admin request rejected")
@@ -4976,6 +6393,7 @@ def delete_user(user_id: int):
     # Delete the user
     db.session.delete(user_to_delete)
     db.session.commit()
+    invalidate_user_cache([user_email])
     
     # Log admin action
     log_admin_action(
@@ -4983,7 +6401,7 @@ def delete_user(user_id: int):
         "delete_user",
         "user",
         user_id,
-        json.dumps({"deleted_user_email": user_email, "deleted_user_role": user_role})
+        {"deleted_user_email": user_email, "deleted_user_role": user_role}
     )
     
     return jsonify(ok=True, message=f"User '{user_email}' deleted successfully")
@@ -4992,8 +6410,14 @@ def delete_user(user_id: int):
 @limiter.limit("30 per minute")
 def list_all_users():
     """
-    List all users in the system.
+    List all users in the system, newest first.
     Only admins can access this endpoint.
+    
+    Query parameters:
+    - limit: Maximum number of users to return (default: 100, max: 500)
+    - cursor: next_cursor value from the previous page (optional)
+    
+    The response is streamed so large pages are never fully materialized.
     """
     user, err = get_current_user()
     if err:
@@ -5002,47 +6426,292 @@ def list_all_users():
     if user.role != "admin":
         return jsonify(error="only admins can list all users"), 403
     
-    users = User.query.order_by(User.created_at.desc()).all()
+    try:
+        limit = max(1, min(int(request.args.get("limit", 100)), 500))
+    except ValueError:
+        return jsonify(error="invalid limit"), 400
+    cursor = request.args.get("cursor")
     
-    return jsonify(
-        ok=True,
-        users=[u.to_dict() for u in users],
-        total=len(users)
-    )
+    total_count = db.session.query(func.count(User.id)).scalar()
+    
+    # Keyset pagination on (created_at, id) so deep pages stay cheap.
+    # Only the to_dict() columns are selected (no password hashes or codes)
+    columns = [getattr(User, name) for name in User._COLUMNS]
+    query = db.session.query(*columns, User.created_at)
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = cursor.rsplit("|", 1)
+            cursor_created_at = datetime.datetime.fromisoformat(cursor_created_at)
+            cursor_id = int(cursor_id)
+        except ValueError:
+            return jsonify(error="invalid cursor"), 400
+        query = query.filter(or_(
+            User.created_at < cursor_created_at,
+            and_(User.created_at == cursor_created_at, User.id < cursor_id),
+        ))
+    query = query.order_by(User.created_at.desc(), User.id.desc()).limit(limit)
+    
+    def generate():
+        yield f'{{"ok": true, "total": {total_count}, "limit": {limit}, "users": ['
+        count = 0
+        last = None
+        # One chunk per yield_per batch: a single join + write instead of one per row
+        for rows in db.session.execute(query.statement, execution_options={"yield_per": 200}).partitions():
+            chunk = ",".join(json_text(dict(zip(User._COLUMNS, row))) for row in rows)
+            yield ("," if count else "") + chunk
+            count += len(rows)
+            last = rows[-1]
+        next_cursor = f"{last.created_at.isoformat()}|{last.id}" if last and count == limit else None
+        yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+    
+    return Response(stream_with_context(generate()), mimetype="application/json")
 
 # --- Ensure DB tables exist on startup (Render + local) ---
-with app.app_context():
+
+# Arbitrary key for pg_advisory_lock so only one gunicorn worker migrates at a time
+MIGRATION_LOCK_ID = 727373
+
+def migrate_approval_columns():
+    """Add is_approved, approved_at, approved_by to users if they don't exist"""
+    inspector = inspect(db.engine)
+    
+    # Check if is_approved column exists (works for both PostgreSQL and SQLite)
+    columns = [col['name'] for col in inspector.get_columns('users')]
+    
+    if 'is_approved' not in columns:
+        print("[MIGRATION] Adding is_approved, approved_at, approved_by columns to users table...", flush=True)
+        # One transaction for all DDL + backfill (committed on exit, rolled back on error)
+        with db.engine.begin() as conn:
+            # PostgreSQL uses different syntax
+            if DB_DIALECT == "postgresql":
+                # Single ALTER so the table lock is only taken once
+                conn.execute(text(
+                    "ALTER TABLE users "
+                    "ADD COLUMN IF NOT EXISTS is_approved BOOLEAN NOT NULL DEFAULT FALSE, "
+                    "ADD COLUMN IF NOT EXISTS approved_at TIMESTAMP, "
+                    "ADD COLUMN IF NOT EXISTS approved_by INTEGER"
+                ))
+            else:
+                # SQLite fallback (for backwards compatibility)
+                # SQLite only allows one ADD COLUMN per ALTER TABLE
+                conn.execute(text("ALTER TABLE users ADD COLUMN is_approved BOOLEAN NOT NULL DEFAULT 0"))
+                conn.execute(text("ALTER TABLE users ADD COLUMN approved_at DATETIME"))
+                conn.execute(text("ALTER TABLE users ADD COLUMN approved_by INTEGER"))
+            
+            conn.execute(text("UPDATE users SET is_approved = TRUE WHERE role != 'manager'"))  # Auto-approve existing non-managers
+        print("[MIGRATION] Successfully added new columns to users table", flush=True)
+
+def migrate_permission_indexes():
+    """
+    Ensure composite unique indexes back the permission lookups.
+    New tables get them from the UniqueConstraints on the models; tables created
+    before those constraints existed need the index added explicitly.
+    """
+    inspector = inspect(db.engine)
+    permission_indexes = [
+        ("role_permissions", "ix_roleperm_role_key", ["role", "permission_key"]),
+        ("user_permissions", "ix_userperm_user_key", ["user_id", "permission_key"]),
+    ]
+    for table, index_name, index_columns in permission_indexes:
+        existing = [uc["column_names"] for uc in inspector.get_unique_constraints(table)]
+        existing += [ix["column_names"] for ix in inspector.get_indexes(table)]
+        if index_columns not in existing:
+            print(f"[MIGRATION] Adding unique index {index_name} on {table}...", flush=True)
+            with db.engine.begin() as conn:
+                conn.execute(text(
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table} ({', '.join(index_columns)})"
+                ))
+
+def migrate_stripe_lookup_indexes():
+    """
+    Index the Stripe ids the webhook handlers look dealerships up by.
+    The model declares them unique, but tables created before that have no index.
+    """
+    inspector = inspect(db.engine)
+    existing = [uc["column_names"] for uc in inspector.get_unique_constraints("dealerships")]
+    existing += [ix["column_names"] for ix in inspector.get_indexes("dealerships")]
+    stripe_indexes = [
+        ("ix_dealerships_stripe_customer_id", "stripe_customer_id", ""),
+        ("ix_dealerships_stripe_subscription_id", "stripe_subscription_id", "UNIQUE "),
+    ]
+    for index_name, column, unique in stripe_indexes:
+        if [column] not in existing:
+            print(f"[MIGRATION] Adding index {index_name} on dealerships...", flush=True)
+            with db.engine.begin() as conn:
+                conn.execute(text(f"CREATE {unique}INDEX IF NOT EXISTS {index_name} ON dealerships ({column})"))
+
+def create_model_indexes(*models):
+    """
+    Create any indexes declared on these models that are missing from existing
+    tables (create_all only adds indexes when it creates the table itself).
+    """
+    with db.engine.begin() as conn:
+        for model in models:
+            for index in model.__table__.indexes:
+                index.create(conn, checkfirst=True)
+
+def migrate_analytics_indexes():
+    """Composite indexes behind the analytics queries"""
+    create_model_indexes(SurveyAccessCode, SurveyAnswer, SurveyResponse)
+
+def migrate_reporting_indexes():
+    """
+    created_at / (employee_status, role) indexes for the summary and breakdown
+    aggregates, plus the unique (dealership_id, email) index on employees.
+    Fails (and is retried next startup) if duplicate employee emails exist.
+    """
+    create_model_indexes(SurveyAccessCode, SurveyResponse, Employee)
+
+def migrate_survey_score_columns():
+    """Add the per-response score totals to survey_responses and backfill them"""
+    score_columns = ["satisfaction_sum", "satisfaction_count", "training_sum", "training_count"]
+    columns = [col['name'] for col in inspect(db.engine).get_columns('survey_responses')]
+    missing = [name for name in score_columns if name not in columns]
+    if missing:
+        print(f"[MIGRATION] Adding {', '.join(missing)} to survey_responses...", flush=True)
+        with db.engine.begin() as conn:
+            if DB_DIALECT == "postgresql":
+                conn.execute(text(
+                    "ALTER TABLE survey_responses "
+                    + ", ".join(f"ADD COLUMN IF NOT EXISTS {name} INTEGER NOT NULL DEFAULT 0" for name in missing)
+                ))
+            else:
+                # SQLite only allows one ADD COLUMN per ALTER TABLE
+                for name in missing:
+                    conn.execute(text(f"ALTER TABLE survey_responses ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0"))
+
+    # Backfill from the stored JSON answers in batches
+    rows = db.session.query(
+        SurveyResponse.id, SurveyResponse.satisfaction_answers, SurveyResponse.training_answers
+    ).yield_per(500)
+    batch = []
+    for response_id, satisfaction_answers, training_answers in rows:
+        satisfaction_sum, satisfaction_count = score_answers(satisfaction_answers)
+        training_sum, training_count = score_answers(training_answers)
+        batch.append({
+            "id": response_id,
+            "satisfaction_sum": satisfaction_sum,
+            "satisfaction_count": satisfaction_count,
+            "training_sum": training_sum,
+            "training_count": training_count,
+        })
+        if len(batch) >= 500:
+            db.session.execute(update(SurveyResponse), batch)
+            batch = []
+    if batch:
+        db.session.execute(update(SurveyResponse), batch)
+
+def migrate_survey_payload_jsonb():
+    """survey_answers.payload used to be TEXT holding a JSON string; convert it to JSONB on PostgreSQL"""
+    if DB_DIALECT != "postgresql":
+        return  # SQLite stores JSON as text either way
+    columns = {col['name']: col['type'] for col in inspect(db.engine).get_columns('survey_answers')}
+    if not isinstance(columns.get('payload'), JSONB):
+        print("[MIGRATION] Converting survey_answers.payload to JSONB...", flush=True)
+        with db.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE survey_answers ALTER COLUMN payload TYPE JSONB USING payload::jsonb"))
+
+def migrate_webhook_claimed_at():
+    """Add webhook_events.claimed_at so abandoned 'processing' batches can be reclaimed"""
+    columns = [col['name'] for col in inspect(db.engine).get_columns('webhook_events')]
+    if 'claimed_at' not in columns:
+        print("[MIGRATION] Adding claimed_at to webhook_events...", flush=True)
+        with db.engine.begin() as conn:
+            if DB_DIALECT == "postgresql":
+                conn.execute(text("ALTER TABLE webhook_events ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP"))
+            else:
+                conn.execute(text("ALTER TABLE webhook_events ADD COLUMN claimed_at DATETIME"))
+
+def migrate_webhook_retry_columns():
+    """
+    Add webhook_events.attempts / next_attempt_at, and requeue events that were
+    marked failed before retries existed (Stripe won't redeliver them)
+    """
+    columns = [col['name'] for col in inspect(db.engine).get_columns('webhook_events')]
+    with db.engine.begin() as conn:
+        if 'attempts' not in columns:
+            print("[MIGRATION] Adding attempts, next_attempt_at to webhook_events...", flush=True)
+            if DB_DIALECT == "postgresql":
+                conn.execute(text(
+                    "ALTER TABLE webhook_events "
+                    "ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0, "
+                    "ADD COLUMN IF NOT EXISTS next_attempt_at TIMESTAMP"
+                ))
+            else:
+                conn.execute(text("ALTER TABLE webhook_events ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0"))
+                conn.execute(text("ALTER TABLE webhook_events ADD COLUMN next_attempt_at DATETIME"))
+        conn.execute(text("UPDATE webhook_events SET status = 'pending' WHERE status = 'failed'"))
+
+def migrate_employee_listing_index():
+    """(dealership_id, created_at, id) index behind the paginated /employees listing"""
+    create_model_indexes(Employee)
+
+# Applied in order; each name is recorded in schema_migrations once it succeeds
+MIGRATIONS = [
+    ("add_approval_columns", migrate_approval_columns),
+    ("add_permission_indexes", migrate_permission_indexes),
+    ("add_analytics_indexes", migrate_analytics_indexes),
+    ("add_survey_score_columns", migrate_survey_score_columns),
+    ("add_reporting_indexes", migrate_reporting_indexes),
+    ("survey_payload_jsonb", migrate_survey_payload_jsonb),
+    ("add_employee_listing_index", migrate_employee_listing_index),
+    ("add_stripe_lookup_indexes", migrate_stripe_lookup_indexes),
+    ("add_webhook_claimed_at", migrate_webhook_claimed_at),
+    ("add_webhook_retry_columns", migrate_webhook_retry_columns),
+]
+
+def _apply_migrations():
     db.create_all()
     
-    # Migrate: Add new columns to users table if they don't exist
-    try:
-        inspector = inspect(db.engine)
-        
-        # Check if is_approved column exists (works for both PostgreSQL and SQLite)
-        columns = [col['name'] for col in inspector.get_columns('users')]
-        
-        if 'is_approved' not in columns:
-            print("[MIGRATION] Adding is_approved, approved_at, approved_by columns to users table...", flush=True)
-            with db.engine.connect() as conn:
-                # PostgreSQL uses different syntax
-                if 'postgresql' in str(db.engine.url):
-                    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_approved BOOLEAN NOT NULL DEFAULT FALSE"))
-                    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS approved_at TIMESTAMP"))
-                    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS approved_by INTEGER"))
-                else:
-                    # SQLite fallback (for backwards compatibility)
-                    conn.execute(text("ALTER TABLE users ADD COLUMN is_approved BOOLEAN NOT NULL DEFAULT 0"))
-                    conn.execute(text("ALTER TABLE users ADD COLUMN approved_at DATETIME"))
-                    conn.execute(text("ALTER TABLE users ADD COLUMN approved_by INTEGER"))
-                
-                conn.execute(text("UPDATE users SET is_approved = TRUE WHERE role != 'manager'"))  # Auto-approve existing non-managers
-                conn.commit()
-            print("[MIGRATION] Successfully added new columns to users table", flush=True)
-        
-    except Exception as e:
-        print(f"[MIGRATION] Error during migration (may already be migrated): {e}", flush=True)
-    
-    print("[OK] Ensured all DB tables exist in", db.engine.url)
+    applied = {name for (name,) in db.session.query(SchemaMigration.name).all()}
+    for name, migrate in MIGRATIONS:
+        if name in applied:
+            continue
+        try:
+            migrate()
+            db.session.add(SchemaMigration(name=name))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[MIGRATION] Error during {name} (will retry on next startup): {e}", flush=True)
+
+def run_migrations():
+    """
+    Create tables and apply any pending migrations.
+    On PostgreSQL this holds an advisory lock so concurrent workers wait for the
+    first one instead of racing; they then find every migration recorded and skip.
+    SQLite has no such lock, so no extra connection is held there.
+    """
+    if DB_DIALECT != "postgresql":
+        _apply_migrations()
+        return
+    with db.engine.connect() as lock_conn:
+        # Session-level lock: held until unlocked or this connection closes
+        lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_ID})
+        lock_conn.commit()
+        try:
+            _apply_migrations()
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_ID})
+            lock_conn.commit()
+
+def init_db():
+    """Create tables, apply pending migrations and warm the access-code cache"""
+    with app.app_context():
+        run_migrations()
+        warm_active_code_cache()
+        print("[OK] Ensured all DB tables exist in", db.engine.url)
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Run schema setup once, e.g. as a deploy/release step: flask --app app init-db"""
+    init_db()
+
+# Runs on import by default so local dev just works. Deploys that run
+# `flask --app app init-db` as a release step set RUN_DB_INIT=0 so each
+# gunicorn worker skips the schema round trips on boot.
+if os.getenv("RUN_DB_INIT", "1") == "1":
+    init_db()
 
 @app.post("/admin/cleanup-unsubscribed")
 @limiter.limit("10 per hour")
@@ -5060,17 +6729,19 @@ def cleanup_unsubscribed_admins():
         deleted_count = 0
         
         # 1. Delete unverified admin registrations immediately (no time threshold)
-        unverified = User.query.filter(
-            User.role == "manager",
-            User.is_verified == False,
-            User.is_approved == False,
-            User.dealership_id == None
-        ).all()
-        
-        for user in unverified:
-            print(f"[CLEANUP] Deleting unverified admin account: {user.email} (created {user.created_at})", flush=True)
-            db.session.delete(user)
-            deleted_count += 1
+        # No email is sent for these, so a single bulk DELETE is enough
+        deleted_emails = db.session.execute(
+            delete(User).where(
+                User.role == "manager",
+                User.is_verified == False,
+                User.is_approved == False,
+                User.dealership_id == None
+            ).returning(User.email)
+        ).scalars().all()
+        deleted_count += len(deleted_emails)
+        # Bulk DELETE bypasses the after_flush hook; drop their cache entries after commit
+        db.session.info.setdefault("_dirty_users", set()).update(deleted_emails)
+        print(f"[CLEANUP] Deleted {len(deleted_emails)} unverified admin account(s)", flush=True)
         
         # 2. Delete verified but unsubscribed admin accounts after time threshold
         verified_unsubscribed = User.query.filter(
@@ -5081,14 +6752,20 @@ def cleanup_unsubscribed_admins():
             User.created_at < threshold_time
         ).all()
         
+        pending_emails = []
         for user in verified_unsubscribed:
             print(f"[CLEANUP] Deleting verified but unsubscribed admin account: {user.email} (created {user.created_at}, verified but not subscribed after {hours_threshold}h)", flush=True)
-            # Send deletion email for verified users
-            try:
-                user_email = user.email
-                user_full_name = user.full_name or "User"
-                subject = "Star4ce – Account Cancellation"
-                body = f"""Hello {user_full_name},
+            # Queue deletion email for verified users; sent after the commit
+            pending_emails.append((user.email, user.full_name or "User"))
+            db.session.delete(user)
+            deleted_count += 1
+        
+        db.session.commit()
+        
+        # Hand the emails to the background sender so the request doesn't wait on them
+        subject = "Star4ce – Account Cancellation"
+        for user_email, user_full_name in pending_emails:
+            body = f"""Hello {user_full_name},
 
 Your Star4ce account ({user_email}) has been automatically deleted because you did not complete your subscription within the required time.
 
@@ -5098,14 +6775,10 @@ Thank you for your interest in Star4ce.
 
 – Star4ce Team
 """
-                send_email_via_resend_or_smtp(user_email, subject, body)
+            try:
+                queue_email(user_email, subject, body)
             except Exception as e:
-                print(f"[CLEANUP WARNING] Failed to send deletion email to {user.email}: {e}", flush=True)
-            
-            db.session.delete(user)
-            deleted_count += 1
-        
-        db.session.commit()
+                print(f"[CLEANUP WARNING] Failed to queue deletion email to {user_email}: {e}", flush=True)
         
         return jsonify(
             ok=True,
@@ -5193,10 +6866,10 @@ Thank you for your interest in Star4ce.
 
 – Star4ce Team
 """
-            send_email_via_resend_or_smtp(user_email, subject, body)
-            print(f"[DELETION] Account deleted and notification sent to {user_email}", flush=True)
+            queue_email(user_email, subject, body)
+            print(f"[DELETION] Account deleted and notification queued for {user_email}", flush=True)
         except Exception as e:
-            print(f"[DELETION WARNING] Account deleted but email failed: {e}", flush=True)
+            print(f"[DELETION WARNING] Account deleted but email could not be queued: {e}", flush=True)
             # Don't fail the deletion if email fails
         
         return jsonify(
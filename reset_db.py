@@ -4,6 +4,8 @@ Simple script to reset the database (delete and recreate all tables).
 Works with both SQLite and PostgreSQL.
 """
 
+import gc
+import glob
 import os
 import sys
 
@@ -14,50 +16,127 @@ load_dotenv()
 # Add the current directory to the path so we can import app
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# Import Flask app and database
-from app import app, db
+# Flask app, database and its dialect ("postgresql"/"sqlite"), imported on first
+# use (see load_app) so --help and argument errors don't pay for importing
+# Flask, SQLAlchemy and Stripe
+app = db = DB_DIALECT = None
+
+def load_app():
+    """Import app.py's Flask app and db once and expose them as module globals."""
+    global app, db, DB_DIALECT
+    if app is None:
+        from app import app as flask_app, db as flask_db, DB_DIALECT as dialect
+        app, db, DB_DIALECT = flask_app, flask_db, dialect
+    return app, db
+
+# Progress lines are queued and written in one go; problems are not held back
+_status_lines = []
+
+def status(message=""):
+    """Queue a progress line; written by flush_status()"""
+    _status_lines.append(message)
+
+def flush_status():
+    if _status_lines:
+        sys.stdout.write("\n".join(_status_lines) + "\n")
+        sys.stdout.flush()
+        _status_lines.clear()
+
+def fail(message):
+    """Errors and warnings go straight to stderr (after any queued progress lines)"""
+    flush_status()
+    print(message, file=sys.stderr, flush=True)
+
+def remove_sqlite_files(db_path):
+    """Delete a SQLite database and its -wal/-shm/-journal sidecar files."""
+    for path in glob.glob(glob.escape(db_path) + "*"):
+        if path == db_path or path[len(db_path):] in ("-wal", "-shm", "-journal"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def run_migrations():
+    """Add the approval columns to a users table created before they existed."""
+    from sqlalchemy import text, inspect
+    try:
+        columns = [col['name'] for col in inspect(db.engine).get_columns('users')]
+
+        if 'is_approved' not in columns:
+            status("   Running migrations...")
+            # One transaction (and one ALTER on PostgreSQL) so the table
+            # is locked/rewritten once and the commit syncs once
+            with db.engine.connect() as conn:
+                if DB_DIALECT == "postgresql":
+                    conn.execute(text(
+                        "ALTER TABLE users "
+                        "ADD COLUMN IF NOT EXISTS is_approved BOOLEAN NOT NULL DEFAULT FALSE, "
+                        "ADD COLUMN IF NOT EXISTS approved_at TIMESTAMP, "
+                        "ADD COLUMN IF NOT EXISTS approved_by INTEGER"
+                    ))
+                else:
+                    # Take the write lock up front rather than upgrading
+                    # mid-transaction and hitting SQLITE_BUSY
+                    conn.exec_driver_sql("BEGIN IMMEDIATE")
+                    # SQLite only allows one ADD COLUMN per ALTER
+                    conn.execute(text("ALTER TABLE users ADD COLUMN is_approved BOOLEAN NOT NULL DEFAULT 0"))
+                    conn.execute(text("ALTER TABLE users ADD COLUMN approved_at DATETIME"))
+                    conn.execute(text("ALTER TABLE users ADD COLUMN approved_by INTEGER"))
+
+                conn.execute(text("UPDATE users SET is_approved = TRUE WHERE role != 'manager'"))
+                conn.commit()
+            status("   ✅ Migrations completed")
+        else:
+            status("   ✅ users table already up to date")
+        return True
+    except Exception as e:
+        fail(f"   ⚠️  Migration check skipped: {e}")
+        return False
 
 def reset_database():
     """Delete/drop all tables and recreate them."""
+    # Importing the app prints its own startup output (and may wait on the
+    # migration lock), so do it before anything is buffered
+    load_app()
+    try:
+        return _reset_database()
+    finally:
+        flush_status()
+
+def _reset_database():
     with app.app_context():
         # Get database URL
         db_url = app.config.get("SQLALCHEMY_DATABASE_URI", "")
         
-        print("🔄 Resetting database...")
-        print(f"   Database: {db_url}")
+        status("🔄 Resetting database...")
+        status(f"   Database: {db_url}")
+        
+        fresh_schema = True
         
         # Check if it's SQLite
-        if db_url.startswith("sqlite:///"):
+        if DB_DIALECT == "sqlite":
             # For SQLite, we need to close all connections before deleting the file
             # This is especially important on Windows where SQLite locks the file
-            print("   Closing all database connections...")
+            status("   Closing all database connections...")
             try:
-                db.session.close()
-                db.engine.dispose()
-                print("   ✅ All connections closed")
+                db.session.remove()
+                # Fold the WAL back into the main file so no sidecar holds data
+                with db.engine.connect() as conn:
+                    conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+                db.engine.dispose(close=True)
+                # Drop any lingering cursor/connection references holding the file open
+                gc.collect()
+                status("   ✅ All connections closed")
             except Exception as e:
-                print(f"   ⚠️  Warning while closing connections: {e}")
+                fail(f"   ⚠️  Warning while closing connections: {e}")
             
-            # For SQLite, we can just delete the file
+            # For SQLite, delete the file together with its -wal/-shm sidecars
+            # (a stale WAL left behind would be replayed into the new database)
             db_path = db_url.replace("sqlite:///", "")
             
             # Handle Windows paths
             if "\\" in db_path or "/" in db_path:
-                # It's a path
-                if os.path.exists(db_path):
-                    print(f"   Deleting SQLite database file: {db_path}")
-                    try:
-                        os.remove(db_path)
-                        print("   ✅ Database file deleted")
-                    except PermissionError:
-                        print("   ❌ Error: Cannot delete database file - it may be in use.")
-                        print("   💡 Tip: Make sure the Flask server is not running.")
-                        return False
-                    except Exception as e:
-                        print(f"   ❌ Error deleting database file: {e}")
-                        return False
-                else:
-                    print(f"   ⚠️  Database file not found: {db_path}")
+                possible_paths = [db_path]
             else:
                 # Relative path, try to find it
                 possible_paths = [
@@ -65,74 +144,62 @@ def reset_database():
                     os.path.join("instance", db_path),
                     os.path.join(os.path.dirname(__file__), "instance", db_path)
                 ]
-                deleted = False
-                for path in possible_paths:
-                    if os.path.exists(path):
-                        print(f"   Deleting SQLite database file: {path}")
-                        try:
-                            os.remove(path)
-                            print("   ✅ Database file deleted")
-                            deleted = True
-                            break
-                        except PermissionError:
-                            print(f"   ❌ Error: Cannot delete database file at {path} - it may be in use.")
-                            print("   💡 Tip: Make sure the Flask server is not running.")
-                            return False
-                        except Exception as e:
-                            print(f"   ❌ Error deleting database file: {e}")
-                            return False
-                if not deleted:
-                    print(f"   ⚠️  Database file not found (tried: {', '.join(possible_paths)})")
+            path = next((p for p in possible_paths if os.path.exists(p)), None)
+            if path:
+                status(f"   Deleting SQLite database file: {path}")
+                try:
+                    remove_sqlite_files(path)
+                    status("   ✅ Database file deleted")
+                except PermissionError:
+                    fail(f"   ❌ Error: Cannot delete database file at {path} - it may be in use.")
+                    fail("   💡 Tip: Make sure the Flask server is not running.")
+                    return False
+                except Exception as e:
+                    fail(f"   ❌ Error deleting database file: {e}")
+                    return False
+            else:
+                fail(f"   ⚠️  Database file not found (tried: {', '.join(possible_paths)})")
         else:
             # For PostgreSQL, drop all tables
-            print("   Dropping all tables from PostgreSQL database...")
+            status("   Dropping all tables from PostgreSQL database...")
             try:
-                db.drop_all()
-                print("   ✅ All tables dropped")
+                # One DROP ... CASCADE instead of drop_all()'s statement per table
+                from sqlalchemy import text
+                quote = db.engine.dialect.identifier_preparer.quote
+                names = [quote(t.name) for t in db.metadata.sorted_tables]
+                if names:
+                    with db.engine.begin() as conn:
+                        conn.execute(text(f"DROP TABLE IF EXISTS {', '.join(names)} CASCADE"))
+                status("   ✅ All tables dropped")
             except Exception as e:
-                print(f"   ⚠️  Error dropping tables: {e}")
-                print("   Continuing anyway...")
+                fail(f"   ⚠️  Error dropping tables: {e}")
+                fail("   Continuing anyway...")
+                fresh_schema = False
         
         # Recreate all tables
-        print("\n📦 Creating all tables...")
+        status("\n📦 Creating all tables...")
         try:
-            db.create_all()
-            print("   ✅ All tables created successfully!")
+            if DB_DIALECT == "sqlite":
+                # pysqlite autocommits each DDL statement; an explicit BEGIN makes
+                # every CREATE TABLE/INDEX share one transaction and one commit
+                with db.engine.connect() as conn:
+                    conn.exec_driver_sql("BEGIN")
+                    db.metadata.create_all(bind=conn)
+                    conn.commit()
+            else:
+                db.create_all()
+            status("   ✅ All tables created successfully!")
             
-            # Run migrations if needed (from app.py)
-            try:
-                from sqlalchemy import text, inspect
-                inspector = inspect(db.engine)
-                
-                # Check if is_approved column exists
-                try:
-                    columns = [col['name'] for col in inspector.get_columns('users')]
-                    
-                    if 'is_approved' not in columns:
-                        print("   Running migrations...")
-                        with db.engine.connect() as conn:
-                            if 'postgresql' in str(db.engine.url):
-                                conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_approved BOOLEAN NOT NULL DEFAULT FALSE"))
-                                conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS approved_at TIMESTAMP"))
-                                conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS approved_by INTEGER"))
-                            else:
-                                conn.execute(text("ALTER TABLE users ADD COLUMN is_approved BOOLEAN NOT NULL DEFAULT 0"))
-                                conn.execute(text("ALTER TABLE users ADD COLUMN approved_at DATETIME"))
-                                conn.execute(text("ALTER TABLE users ADD COLUMN approved_by INTEGER"))
-                            
-                            conn.execute(text("UPDATE users SET is_approved = TRUE WHERE role != 'manager'"))
-                            conn.commit()
-                        print("   ✅ Migrations completed")
-                except Exception as e:
-                    print(f"   ⚠️  Migration check skipped: {e}")
-            except Exception as e:
-                print(f"   ⚠️  Migration check skipped: {e}")
+            # create_all() just built users from the model (approval columns
+            # included), so the column check only matters if old tables survived
+            if not fresh_schema or os.getenv("RUN_MIGRATIONS") == "1":
+                run_migrations()
             
         except Exception as e:
-            print(f"   ❌ Error creating tables: {e}")
+            fail(f"   ❌ Error creating tables: {e}")
             return False
         
-        print("\n✅ Database reset complete!")
+        status("\n✅ Database reset complete!")
         return True
 
 if __name__ == "__main__":
@@ -140,13 +207,31 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description="Reset the database (delete and recreate all tables)")
     parser.add_argument("--yes", action="store_true", help="Skip confirmation prompt")
+    parser.add_argument("--force", action="store_true", help="Allow running with ENVIRONMENT=production")
+    parser.add_argument("--upgrade-users-only", action="store_true",
+                        help="Only add missing approval columns to users; keep all data")
     args = parser.parse_args()
     
+    if args.upgrade_users_only:
+        # Non-destructive schema patch: no drop, no confirmation needed
+        print("🔧 Upgrading users table...")
+        load_app()
+        with app.app_context():
+            ok = run_migrations()
+        flush_status()
+        sys.exit(0 if ok else 1)
+    
     print("=" * 60)
     print("🗑️  Database Reset Script")
     print("=" * 60)
     print()
     
+    # Refuse to wipe a production database unless explicitly forced
+    if os.getenv("ENVIRONMENT") == "production" and not args.force:
+        print("❌ ENVIRONMENT=production - refusing to reset the database.")
+        print("   Re-run with --force if you really mean it.")
+        sys.exit(1)
+    
     if not args.yes:
         confirm = input("⚠️  This will DELETE ALL DATA. Continue? (yes/no): ")
         if confirm.lower() != 'yes':